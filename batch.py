@@ -0,0 +1,184 @@
+"""
+Batch runner for balancing levels and evaluating bots. Plays many seeded headless games in parallel,
+one process per core, with a player policy deciding the inputs of every frame:
+  python batch.py --games 2000 --policy boxes --output games.jsonl
+Every finished game is written as one JSON line as soon as it is done, and a report aggregated over all
+games is printed at the end. Policies are the built-in ones below or any "module:name" callable that takes
+a random.Random and returns a function from a GameSim to the inputs for its next step.
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Keep stdout to the JSON report
+
+from levels import level_specs, load_specs
+from sim import GameSim, KEY_LEFT, KEY_RIGHT, KEY_UP, KEY_DOWN, KEY_SPACE, KEY_RELEASE
+
+DIRECTIONS = (KEY_LEFT, KEY_UP, KEY_RIGHT, KEY_DOWN)
+
+
+# POLICIES
+
+class IdlePolicy:
+  """
+  Never presses anything, a baseline for how long the enemies take to win on their own
+  """
+  def __init__(self, rng):
+    pass
+
+  def __call__(self, sim):
+    return 0
+
+
+class RandomPolicy:
+  """
+  Presses a random key (or nothing) every period frames
+  """
+  def __init__(self, rng, period=10):
+    self.rng = rng
+    self.period = period
+
+  def __call__(self, sim):
+    if sim.frame % self.period:
+      return 0
+    return self.rng.choice(DIRECTIONS + (KEY_SPACE, KEY_RELEASE, 0))
+
+
+class BoxPolicy:
+  """
+  Draws boxes: starts an incursion in a random direction, turns once, comes back parallel to
+  the way in until it meets the boundary, then walks along the edge for a while and starts again
+  timer: frames left in the current phase
+  turns: inputs still to press, one per phase
+  """
+  def __init__(self, rng):
+    self.rng = rng
+    self.timer = 0
+    self.turns = []
+
+  def __call__(self, sim):
+    if self.timer > 0:
+      self.timer -= 1
+      return 0
+    if self.turns:
+      inputs, self.timer = self.turns.pop(0)
+      return inputs
+    rng = self.rng
+    i = rng.randrange(4)
+    way_in, side, way_out = DIRECTIONS[i], DIRECTIONS[(i + rng.choice((1, 3))) % 4], DIRECTIONS[(i + 2) % 4]
+    self.turns = [(KEY_RELEASE | side, rng.randrange(4, 20)), (KEY_RELEASE | way_out, 80),
+                  (KEY_RELEASE | rng.choice(DIRECTIONS), rng.randrange(10, 60))]
+    self.timer = rng.randrange(4, 20)
+    return KEY_RELEASE | KEY_SPACE | way_in
+
+
+POLICIES = {"idle": IdlePolicy, "random": RandomPolicy, "boxes": BoxPolicy}
+
+
+def load_policy(name):
+  """
+  Policy class or factory for a built-in name or a "module:name" reference
+  """
+  if name in POLICIES:
+    return POLICIES[name]
+  module, _, attribute = name.partition(":")
+  if not attribute:
+    raise ValueError(f"unknown policy {name!r}, use one of {', '.join(POLICIES)} or module:name")
+  return getattr(importlib.import_module(module), attribute)
+
+
+# GAMES
+
+def play_game(seed, policy_name, max_frames=20000, levels_dir=None, target=None, enemy_backend="auto"):
+  """
+  Play one game to the end (or max_frames) and return its result as a dict
+  """
+  levels = level_specs if levels_dir is None else load_specs(levels_dir)
+  if target is not None:
+    levels = [spec._replace(target=target) for spec in levels]
+  sim = GameSim(levels, enemy_backend=enemy_backend, seed=seed)
+  policy = load_policy(policy_name)(random.Random(f"{seed}:policy"))
+
+  captured, lives_lost = 0, 0
+  start = time.perf_counter()
+  while sim.state == "playing" and sim.frame < max_frames:
+    map, player, level = sim.map, sim.player, sim.level
+    sim.step(policy(sim))
+    if sim.level != level:  # Completed a level, the sim has already moved on to the next one
+      captured += map.captured_area
+      lives_lost += levels[level].player.lives - player.lives
+  captured += sim.map.captured_area
+  lives_lost += levels[sim.level].player.lives - sim.player.lives
+  return {"seed": seed, "policy": policy_name, "result": sim.state if sim.state != "playing" else "timeout",
+          "level": sim.level + 1, "frames": sim.frame, "area_captured": captured, "lives_lost": lives_lost,
+          "seconds": time.perf_counter() - start}
+
+
+def aggregate(results):
+  """
+  Report over a list of play_game() results
+  """
+  games = len(results)
+  if games == 0:
+    return {"games": 0}
+  outcomes = {}
+  levels = {}
+  for result in results:
+    outcomes[result["result"]] = outcomes.get(result["result"], 0) + 1
+    levels[result["level"]] = levels.get(result["level"], 0) + 1
+  def mean(key):
+    return sum(result[key] for result in results) / games
+  frames = sorted(result["frames"] for result in results)
+  return {"games": games, "outcomes": outcomes, "win_rate": outcomes.get("win", 0) / games,
+          "level_reached": dict(sorted(levels.items())), "mean_frames": mean("frames"),
+          "median_frames": frames[games // 2], "mean_area_captured": mean("area_captured"),
+          "mean_lives_lost": mean("lives_lost"),
+          "frames_per_core_second": sum(frames) / max(sum(result["seconds"] for result in results), 1e-9)}
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Play many headless games in parallel and report how they went")
+  parser.add_argument("--games", type=int, default=100, help="number of games to play")
+  parser.add_argument("--seed", type=int, default=0, help="seed of the first game, game i uses seed + i")
+  parser.add_argument("--policy", default="boxes", help=f"{', '.join(POLICIES)} or module:name")
+  parser.add_argument("--max-frames", type=int, default=20000, help="stop games that last longer than this")
+  parser.add_argument("--levels", help="directory of level<number>.json files to play instead of maps/")
+  parser.add_argument("--target", type=float, help="override the target of every level")
+  parser.add_argument("--backend", choices=["auto", "objects", "pool"], default="auto", help="enemy backend")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+  parser.add_argument("--output", help="write every game result as a JSON line to this file")
+  args = parser.parse_args(argv)
+  load_policy(args.policy)  # Fail here rather than in every worker
+
+  results = []
+  output = open(args.output, "w") if args.output else None
+  start = time.perf_counter()
+  with ProcessPoolExecutor(max_workers=args.workers) as executor:
+    futures = [executor.submit(play_game, args.seed + i, args.policy, args.max_frames, args.levels, args.target,
+                               args.backend) for i in range(args.games)]
+    for future in as_completed(futures):
+      result = future.result()
+      results.append(result)
+      if output is not None:
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+  if output is not None:
+    output.close()
+
+  report = aggregate(results)
+  report["workers"] = args.workers
+  report["wall_seconds"] = time.perf_counter() - start
+  report["frames_per_wall_second"] = sum(result["frames"] for result in results) / report["wall_seconds"]
+  print(json.dumps(report, indent=2))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
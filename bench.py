@@ -0,0 +1,234 @@
+"""
+Benchmark harness. Plays every built-in level and a set of generated stress maps with scripted inputs,
+timing the simulation and the renderer separately, and prints the results as JSON:
+  python bench.py --frames 2000 --output bench.json
+With --startup N it also starts main.py N times and times how long the first frame takes to show.
+With --alloc-budget BYTES it fails (exit code 1) if a steady-state frame of any case allocates more than that:
+  python bench.py --cases level-1 level-2 level-3 --frames 300 --alloc-budget 2048
+  python bench.py --cases stress-enemies stress-all --frames 300 --no-render --alloc-budget 2048
+The second line guards the EnemyPool step on its own, drawing hundreds of enemies takes a Python tuple and
+returns a Rect for each of them (Surface.blits) so the frames drawn grow with the number of enemies
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from levels import level_specs, parse_spec
+from sim import GameSim, KEY_LEFT, KEY_RIGHT, KEY_UP, KEY_DOWN, KEY_SPACE, KEY_RELEASE
+
+# Scripted inputs, repeated every SCRIPT_PERIOD frames: a rectangular incursion up from the bottom edge
+# followed by walking along the edge, so every run exercises captures, collisions and edge movement
+SCRIPT_PERIOD = 120
+SCRIPT = {0: KEY_SPACE | KEY_UP, 20: KEY_RELEASE | KEY_RIGHT, 30: KEY_RELEASE | KEY_DOWN,
+          60: KEY_RELEASE | KEY_LEFT, 80: KEY_RELEASE | KEY_RIGHT, 100: KEY_RELEASE}
+
+
+def stress_map(size, qix, sparx, captures, seed=0):
+  """
+  Spec of a square level of the given size with qix Qix, sparx Sparx and captures small territories already captured,
+  5 by 15 notches in the sides of the field 10 apart and clear of the corners (so at most 4 * (size // 10 - 4) of them)
+  """
+  rng = random.Random(seed)
+  left, top = 100, 100
+  right, bottom = left + size, top + size
+  enemies = [{"type": "qix", "x": rng.randrange(left + 30, right - 30), "y": rng.randrange(top + 30, bottom - 30)}
+             for _ in range(qix)]
+  for _ in range(sparx):
+    segment = rng.randrange(4)
+    x = rng.randrange(left, right, 5)
+    y = rng.randrange(top, bottom, 5)
+    x, y = [(x, bottom), (left, y), (x, top), (right, y)][segment]
+    enemies.append({"type": "sparc", "x": x, "y": y, "segment": segment, "vel": rng.choice((-1, 1))})
+  player_x = left + size // 2
+  slots = [(side, along) for side in range(4) for along in range(20, size - 20, 10)
+           if not (side == 0 and left + along <= player_x <= left + along + 5)]
+  captured = []
+  for side, along in rng.sample(slots, captures):
+    x, y = left + along, top + along
+    captured.append([[(x, bottom), (x, bottom - 15), (x + 5, bottom - 15), (x + 5, bottom)],
+                     [(left, y), (left + 15, y), (left + 15, y + 5), (left, y + 5)],
+                     [(x, top), (x, top + 15), (x + 5, top + 15), (x + 5, top)],
+                     [(right, y), (right - 15, y), (right - 15, y + 5), (right, y + 5)]][side])
+  # The target is out of reach, so a run stays on the stress map
+  return parse_spec({"size": size, "corners": [(left, bottom), (left, top), (right, top), (right, bottom)],
+                     "player": {"lives": 10**6, "x": player_x, "y": bottom, "segment": 0},
+                     "enemies": enemies, "target": 0.99, "captured": captured}, "stress")
+
+
+def cases():
+  """
+  Every case as (name, level spec)
+  """
+  for i, spec in enumerate(level_specs):
+    yield f"level-{i + 1}", spec
+  yield "stress-large", stress_map(2000, 4, 4, 0)
+  yield "stress-enemies", stress_map(400, 60, 40, 0)
+  yield "stress-captures", stress_map(400, 2, 2, 120)
+  yield "stress-all", stress_map(1500, 150, 100, 300)
+
+
+def percentiles(samples):
+  samples = sorted(samples)
+  def at(fraction):
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000
+  return {"mean_ms": sum(samples) / len(samples) * 1000, "p50_ms": at(0.5), "p95_ms": at(0.95),
+          "p99_ms": at(0.99), "max_ms": samples[-1] * 1000}
+
+
+def run_case(spec, frames, render=True, seed=0):
+  sim = GameSim([spec], seed=seed)
+  renderer = None
+  if render:
+    from render import Renderer, RESOLUTION
+    renderer = Renderer(pygame.Surface(RESOLUTION), pygame.font.Font(None, 30))
+
+  sim_times, render_times = [], []
+  resets = 0
+  for frame in range(frames):
+    if sim.state != "playing":
+      sim.reset_level(0)
+      resets += 1
+    inputs = SCRIPT.get(frame % SCRIPT_PERIOD, 0)
+    start = time.perf_counter()
+    sim.step(inputs)
+    sim_times.append(time.perf_counter() - start)
+    if renderer is not None:
+      start = time.perf_counter()
+      renderer.draw_game(sim)
+      render_times.append(time.perf_counter() - start)
+
+  result = {"frames": frames, "resets": resets, "captured_area": sim.map.captured_area, "sim": percentiles(sim_times)}
+  if render_times:
+    result["render"] = percentiles(render_times)
+  result["allocations"] = measure_allocations(spec, min(frames, 500), seed, render)
+  result["snapshot"] = measure_snapshot(sim)
+  return result
+
+
+def measure_snapshot(sim, repeat=100):
+  """
+  Size of a snapshot of sim at the end of its run, and the time to take one and to restore it
+  """
+  start = time.perf_counter()
+  for _ in range(repeat):
+    data = sim.snapshot()
+  taken = time.perf_counter()
+  for _ in range(repeat):
+    sim.restore(data)
+  restored = time.perf_counter()
+  return {"bytes": len(data), "save_ms": (taken - start) / repeat * 1000, "restore_ms": (restored - taken) / repeat * 1000}
+
+
+def measure_allocations(spec, frames, seed=0, render=False, warmup=SCRIPT_PERIOD):
+  """
+  Run frames frames (drawn too if render) under tracemalloc, separately since tracing skews the timings.
+  The first warmup frames are not traced, so the one-off work of starting the level is left out.
+  frame_bytes: the most memory each frame had allocated at once on top of what was live when it started.
+  Its p50 is the steady state, its max comes from the frames with captures and level resets
+  """
+  sim = GameSim([spec], seed=seed)
+  renderer = None
+  if render:
+    from render import Renderer, RESOLUTION
+    renderer = Renderer(pygame.Surface(RESOLUTION), pygame.font.Font(None, 30))
+
+  def frame(number):
+    if sim.state != "playing":
+      sim.reset_level(0)
+    sim.step(SCRIPT.get(number % SCRIPT_PERIOD, 0))
+    if renderer is not None:
+      renderer.draw_game(sim)
+
+  for number in range(warmup):
+    frame(number)
+  frame_bytes = []
+  gen0 = gc.get_stats()[0]["collections"]
+  tracemalloc.start()
+  start, _ = tracemalloc.get_traced_memory()
+  overall_peak = start
+  for number in range(warmup, warmup + frames):
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    frame(number)
+    _, peak = tracemalloc.get_traced_memory()
+    frame_bytes.append(peak - before)
+    overall_peak = max(overall_peak, peak)
+  current, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  frame_bytes.sort()
+  return {"frames": frames, "render": render, "peak_kib": (overall_peak - start) / 1024,
+          "retained_kib": (current - start) / 1024, "gc_gen0_collections": gc.get_stats()[0]["collections"] - gen0,
+          "frame_bytes": {"p50": frame_bytes[frames // 2], "p99": frame_bytes[min(int(frames * 0.99), frames - 1)],
+                          "max": frame_bytes[-1]}}
+
+
+def measure_startup(runs):
+  """
+  Start main.py runs times and time each start up to its first frame, from before the process is created
+  (process) and from the first line of main.py (main), which leaves out starting the interpreter
+  """
+  main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+  env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+  process_times, main_times = [], []
+  for _ in range(runs):
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, main_py, "--startup-time"], stdout=subprocess.PIPE, env=env, text=True)
+    line = child.stdout.readline()
+    process_times.append(time.perf_counter() - start)
+    child.wait()
+    if not line.startswith("first frame after "):
+      raise RuntimeError(f"main.py did not show a frame (exit code {child.returncode})")
+    main_times.append(float(line.split()[3]) / 1000)
+  return {"runs": runs, "process": percentiles(process_times), "main": percentiles(main_times)}
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the simulation and renderer on every level and on stress maps")
+  parser.add_argument("--frames", type=int, default=1000, help="frames to run per case")
+  parser.add_argument("--cases", nargs="*", help="only run the cases with these names")
+  parser.add_argument("--no-render", action="store_true", help="only time the simulation")
+  parser.add_argument("--startup", type=int, default=0, metavar="N", help="also time N cold starts of main.py")
+  parser.add_argument("--alloc-budget", type=int, metavar="BYTES",
+                      help="fail if a steady-state frame (p50) of any case allocates more than this")
+  parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+  args = parser.parse_args(argv)
+
+  pygame.font.init()
+  report = {"python": sys.version.split()[0], "pygame": pygame.version.ver, "cases": {}}
+  for name, spec in cases():
+    if args.cases and name not in args.cases:
+      continue
+    report["cases"][name] = run_case(spec, args.frames, not args.no_render)
+    print(f"{name}: sim p99 {report['cases'][name]['sim']['p99_ms']:.3f} ms", file=sys.stderr)
+  if args.startup:
+    report["startup"] = measure_startup(args.startup)
+    print(f"startup: p50 {report['startup']['process']['p50_ms']:.1f} ms", file=sys.stderr)
+
+  text = json.dumps(report, indent=2)
+  if args.output:
+    with open(args.output, "w") as file:
+      file.write(text + "\n")
+  else:
+    print(text)
+
+  if args.alloc_budget is not None:
+    over = {name: case["allocations"]["frame_bytes"]["p50"] for name, case in report["cases"].items()
+            if case["allocations"]["frame_bytes"]["p50"] > args.alloc_budget}
+    for name, allocated in over.items():
+      print(f"FAIL {name}: {allocated} bytes allocated per frame, the budget is {args.alloc_budget}", file=sys.stderr)
+    if over:
+      return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
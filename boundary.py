@@ -0,0 +1,263 @@
+import bisect
+
+
+class Boundary:
+  """
+  Edge of the playable (uncaptured) region, kept as a simple rectilinear polygon and replaced after every capture.
+  Edges are indexed by the line they lie on, so the edge under a point is found with a dict lookup and a binary
+  search, and the corners on either side of it are the edge's own end points.
+  Points on the boundary are also addressed by arc length, their distance from points[0] going along the edges,
+  so things that travel along the boundary only have to add to a number
+  points: corners of the polygon in clockwise order on screen, edge i goes from points[i] to points[i + 1]
+  lengths: arc length of every corner, lengths[i] is where edge i starts and lengths[-1] is the perimeter
+  tangents: unit (dx, dy) direction of every edge
+  perimeter: total length of the edges
+  vertex_edges: corner -> (index of the edge ending at it, index of the edge starting at it)
+  horizontal: y -> (sorted x_min list, matching list of (x_min, x_max, edge index)) for the horizontal edges on that line
+  vertical: x -> (sorted y_min list, matching list of (y_min, y_max, edge index)) for the vertical edges on that line
+  vertical_xs: sorted x of every vertical line, used to find the edges a horizontal move crosses
+  horizontal_ys: sorted y of every horizontal line, used to find the edges a vertical move crosses
+  """
+  def __init__(self, points):
+    points = simplify(points)
+    if signed_area(points) < 0:
+      points.reverse()
+    self.points = points
+    n = len(points)
+    self.vertex_edges = {}
+    horizontal, vertical = {}, {}
+    for i in range(n):
+      a, b = points[i], points[(i + 1) % n]
+      self.vertex_edges[a] = ((i - 1) % n, i)
+      if a[1] == b[1]:
+        horizontal.setdefault(a[1], []).append((min(a[0], b[0]), max(a[0], b[0]), i))
+      else:
+        vertical.setdefault(a[0], []).append((min(a[1], b[1]), max(a[1], b[1]), i))
+    self.horizontal = {y: _interval_index(intervals) for y, intervals in horizontal.items()}
+    self.vertical = {x: _interval_index(intervals) for x, intervals in vertical.items()}
+    self.vertical_xs = sorted(self.vertical)
+    self.horizontal_ys = sorted(self.horizontal)
+    self.lengths = [0]
+    self.tangents = []
+    for i in range(n):
+      (ax, ay), (bx, by) = points[i], points[(i + 1) % n]
+      self.lengths.append(self.lengths[-1] + abs(bx - ax) + abs(by - ay))
+      self.tangents.append((_sign(bx - ax), _sign(by - ay)))
+    self.perimeter = self.lengths[-1]
+
+  def edge(self, index):
+    return self.points[index], self.points[(index + 1) % len(self.points)]
+
+  def edges_at(self, x, y):
+    """
+    Indices of the edges through (x, y): two at a corner, one elsewhere on the boundary and none off it
+    """
+    corner = self.vertex_edges.get((x, y))
+    if corner is not None:
+      return corner
+    for lines, along, across in ((self.horizontal, x, y), (self.vertical, y, x)):
+      interval = _find(lines.get(across), along)
+      if interval is not None:
+        return (interval[2],)
+    return ()
+
+  def arc_at(self, x, y):
+    """
+    Arc length of (x, y), which has to be on the boundary
+    """
+    index = self.edges_at(x, y)[-1]
+    (ax, ay) = self.points[index]
+    return self.lengths[index] + abs(x - ax) + abs(y - ay)
+
+  def point_at(self, arc):
+    """
+    (x, y, edge index) of the point at arc length arc, wrapping around the perimeter
+    """
+    arc %= self.perimeter
+    index = bisect.bisect_right(self.lengths, arc) - 1
+    (ax, ay), (dx, dy) = self.points[index], self.tangents[index]
+    along = arc - self.lengths[index]
+    return ax + dx * along, ay + dy * along, index
+
+  def heading(self, arc, dx, dy):
+    """
+    How to go from arc in the direction (dx, dy) (a unit axis vector) along the boundary, as
+    (1 or -1 for following or going against the order of points, distance to the next corner that way).
+    None if the boundary does not go that way from arc
+    """
+    n = len(self.points)
+    index = bisect.bisect_right(self.lengths, arc) - 1
+    candidates = (index, (index - 1) % n) if arc == self.lengths[index] else (index,)
+    for edge in candidates:
+      start, end = self.lengths[edge], self.lengths[edge + 1]
+      # At points[0] the edge coming into it ends at the perimeter rather than at 0
+      at = arc + self.perimeter if arc < start else arc
+      tangent = self.tangents[edge]
+      if tangent == (dx, dy) and at != end:
+        return 1, end - at
+      if tangent == (-dx, -dy) and at != start:
+        return -1, at - start
+    return None
+
+  def contains(self, x, y):
+    """
+    True if (x, y) is strictly inside the polygon (points on the boundary are not reliably inside or outside)
+    """
+    crossings = 0
+    for line_x in self.vertical_xs[bisect.bisect_right(self.vertical_xs, x):]:
+      for y_min, y_max, _ in self.vertical[line_x][1]:
+        if y_min <= y < y_max:
+          crossings += 1
+    return crossings % 2 == 1
+
+  def first_hit(self, start, end):
+    """
+    First point of the boundary on the axis-aligned move from start to end, not counting start itself, or None.
+    start must not be on the boundary. Every corner joins a horizontal and a vertical edge, so only the edges
+    perpendicular to the move have to be checked
+    """
+    (x1, y1), (x2, y2) = start, end
+    if y1 == y2:
+      lines, line_positions, across, a, b = self.vertical, self.vertical_xs, y1, x1, x2
+    else:
+      lines, line_positions, across, a, b = self.horizontal, self.horizontal_ys, x1, y1, y2
+    low, high = min(a, b), max(a, b)
+    crossed = line_positions[bisect.bisect_left(line_positions, low):bisect.bisect_right(line_positions, high)]
+    for line in (crossed if b > a else reversed(crossed)):
+      if line != a and _find(lines[line], across) is not None:
+        return (line, y1) if y1 == y2 else (x1, line)
+    return None
+
+  def nearest(self, x, y):
+    """
+    Closest point of the boundary to (x, y), as (x, y, edge index)
+    """
+    best = None
+    for index in range(len(self.points)):
+      (ax, ay), (bx, by) = self.edge(index)
+      px = min(max(x, min(ax, bx)), max(ax, bx))
+      py = min(max(y, min(ay, by)), max(ay, by))
+      distance = abs(px - x) + abs(py - y)
+      if best is None or distance < best[0]:
+        best = (distance, px, py, index)
+    return best[1], best[2], best[3]
+
+  def split(self, path):
+    """
+    Cut the polygon along path, a rectilinear polyline from one boundary point to another through the inside,
+    and return the two polygons on either side of it
+    """
+    start, end = path[0], path[-1]
+    ring = self.with_corners([start, end])
+    i_start, i_end = ring.index(start), ring.index(end)
+    m = len(ring)
+    forward = [ring[(i_end + k) % m] for k in range(1, (i_start - i_end) % m)]
+    backward = [ring[(i_end - k) % m] for k in range(1, (i_end - i_start) % m)]
+    return simplify(list(path) + forward), simplify(list(path) + backward)
+
+  def cut_off(self, polygon):
+    """
+    Corners of the polygon left after cutting polygon away from this one. polygon has to be rectilinear, inside
+    this polygon, and its outline has to run along the boundary in one stretch and through the inside in the other,
+    like the side an incursion captures. Raises ValueError for anything else (an island in the middle,
+    a polygon touching the boundary in several places or reaching outside it)
+    """
+    points = simplify(list(polygon))
+    n = len(points)
+    inside = []
+    for i in range(n):
+      (ax, ay), (bx, by) = points[i], points[(i + 1) % n]
+      if ax != bx and ay != by:
+        raise ValueError("the polygon is not rectilinear")
+      inside.append(not self.edges_at((ax + bx) / 2, (ay + by) / 2))
+    starts = [i for i in range(n) if inside[i] and not inside[i - 1]]
+    if len(starts) != 1:
+      raise ValueError("the polygon does not touch the boundary along one stretch")
+    i = starts[0]
+    path = [points[i]]
+    while inside[i]:
+      i = (i + 1) % n
+      path.append(points[i])
+    if self.edges_at(*path[0]) and self.edges_at(*path[-1]):
+      sides = self.split(path)
+      # The cut has the polygon on one side, which is then the polygon itself
+      for side, other in (sides, sides[::-1]):
+        if set(side) == set(points) and len(other) >= 4:
+          return other
+    raise ValueError("the polygon is not inside the boundary")
+
+  def with_corners(self, new_points):
+    """
+    List of the corners with every point of new_points that is on an edge inserted in it
+    """
+    inserted = {}
+    for point in new_points:
+      edges = self.edges_at(*point)
+      if len(edges) == 1:
+        inserted.setdefault(edges[0], []).append(point)
+    ring = []
+    for index, corner in enumerate(self.points):
+      ring.append(corner)
+      for point in sorted(inserted.get(index, []), key=lambda p: abs(p[0] - corner[0]) + abs(p[1] - corner[1])):
+        if point != ring[-1]:
+          ring.append(point)
+    return ring
+
+
+# POLYGON HELPERS
+
+def simplify(points):
+  """
+  Drop repeated points and points in the middle of a straight line from a closed rectilinear polygon
+  """
+  result = []
+  for point in points:
+    if result and point == result[-1]:
+      continue
+    if len(result) >= 2 and _collinear(result[-2], result[-1], point):
+      result[-1] = point
+    else:
+      result.append(point)
+  # The polygon is closed, so also check around the first point
+  while len(result) > 3 and (result[-1] == result[0] or _collinear(result[-2], result[-1], result[0])):
+    result.pop()
+  while len(result) > 3 and _collinear(result[-1], result[0], result[1]):
+    result.pop(0)
+  return result
+
+
+def signed_area(points):
+  """
+  Shoelace area of a polygon, positive if the points go clockwise on screen (y pointing down)
+  """
+  total = 0
+  for i in range(len(points)):
+    (x1, y1), (x2, y2) = points[i - 1], points[i]
+    total += x1 * y2 - x2 * y1
+  return total / 2
+
+
+def _collinear(a, b, c):
+  return (a[0] == b[0] == c[0]) or (a[1] == b[1] == c[1])
+
+
+def _interval_index(intervals):
+  intervals.sort()
+  return ([interval[0] for interval in intervals], intervals)
+
+
+def _find(line, value):
+  """
+  Interval of line (an _interval_index) containing value, or None
+  """
+  if line is None:
+    return None
+  starts, intervals = line
+  k = bisect.bisect_right(starts, value) - 1
+  if k >= 0 and intervals[k][1] >= value:
+    return intervals[k]
+  return None
+
+
+def _sign(value):
+  return (value > 0) - (value < 0)
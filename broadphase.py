@@ -0,0 +1,85 @@
+import pygame
+
+
+class SegmentGrid:
+  """
+  Uniform grid over the segments of the incursion trail, used as a broadphase so that
+  only segments near an enemy are tested exactly with Rect.clipline
+  cell_size: width and height of a grid cell in pixels
+  segments: list of (start, end) point pairs, in trail order
+  cells: maps (column, row) of a grid cell to the set of indices of the segments overlapping it
+  bounds: Rect containing every segment, or None if the grid is empty
+  """
+  def __init__(self, cell_size=32):
+    self.cell_size = cell_size
+    self.segments = []
+    self.cells = {}
+    self.bounds = None
+    self._ranges = []  # Cell range (col_min, row_min, col_max, row_max) covered by each segment
+
+  def clear(self):
+    self.segments.clear()
+    self.cells.clear()
+    self._ranges.clear()
+    self.bounds = None
+
+  def cell_range(self, start, end):
+    size = self.cell_size
+    return (int(min(start[0], end[0]) // size), int(min(start[1], end[1]) // size),
+            int(max(start[0], end[0]) // size), int(max(start[1], end[1]) // size))
+
+  def add(self, start, end):
+    index = len(self.segments)
+    self.segments.append((start, end))
+    cells = self.cell_range(start, end)
+    self._ranges.append(cells)
+    self._insert(index, cells, None)
+    self._grow_bounds(start, end)
+
+  def stretch_last(self, end):
+    """
+    Move the end point of the last segment to end, only touching the grid cells that changed
+    """
+    index = len(self.segments) - 1
+    start = self.segments[index][0]
+    self.segments[index] = (start, end)
+    old_cells = self._ranges[index]
+    new_cells = self.cell_range(start, end)
+    if new_cells != old_cells:
+      self._remove(index, old_cells, new_cells)
+      self._insert(index, new_cells, old_cells)
+      self._ranges[index] = new_cells
+    self._grow_bounds(start, end)
+
+  def query(self, rect):
+    """
+    Return the set of indices of the segments sharing a grid cell with rect
+    """
+    size = self.cell_size
+    found = set()
+    for col in range(rect.left // size, (rect.right - 1) // size + 1):
+      for row in range(rect.top // size, (rect.bottom - 1) // size + 1):
+        indices = self.cells.get((col, row))
+        if indices:
+          found.update(indices)
+    return found
+
+  def _insert(self, index, cells, skip):
+    for col in range(cells[0], cells[2] + 1):
+      for row in range(cells[1], cells[3] + 1):
+        if skip is None or not _in_range(col, row, skip):
+          self.cells.setdefault((col, row), set()).add(index)
+
+  def _remove(self, index, cells, keep):
+    for col in range(cells[0], cells[2] + 1):
+      for row in range(cells[1], cells[3] + 1):
+        if not _in_range(col, row, keep):
+          self.cells[(col, row)].discard(index)
+
+  def _grow_bounds(self, start, end):
+    rect = pygame.Rect(min(start[0], end[0]), min(start[1], end[1]), abs(end[0] - start[0]) + 1, abs(end[1] - start[1]) + 1)
+    self.bounds = rect if self.bounds is None else self.bounds.union(rect)
+
+
+def _in_range(col, row, cells):
+  return cells[0] <= col <= cells[2] and cells[1] <= row <= cells[3]
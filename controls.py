@@ -0,0 +1,150 @@
+import time
+from array import array
+
+import pygame
+
+from sim import KEY_LEFT, KEY_RIGHT, KEY_UP, KEY_DOWN, KEY_SPACE, KEY_RELEASE
+
+DIRECTION_KEYS = {pygame.K_LEFT: KEY_LEFT, pygame.K_RIGHT: KEY_RIGHT, pygame.K_UP: KEY_UP, pygame.K_DOWN: KEY_DOWN}
+
+
+class Controls:
+  """
+  Turns the keyboard into GameSim inputs, once per simulation step. Direction keys are read from the held-key
+  state when the step runs, so releasing one key while another is still held keeps the player moving the held way,
+  and key presses shorter than a step are buffered so they still count for one step
+  held: direction keys being held, in the order they were pressed, the last one is the direction to move in
+  tapped: direction key pressed and released again since the last step, or None
+  space: True if space was pressed since the last step
+  direction: flag of the direction sent to the sim, 0 if the player was told to stop
+  latency: LatencyLog of the time between key presses and the first frame showing their effect
+  """
+  def __init__(self):
+    self.held = []
+    self.tapped = None
+    self.space = False
+    self.direction = 0
+    self.latency = LatencyLog()
+
+  def reset(self):
+    self.held.clear()
+    self.tapped = None
+    self.space = False
+    self.direction = 0
+    self.latency.pending.clear()
+
+  def handle_event(self, event):
+    """
+    Buffer a KEYDOWN or KEYUP event, returns True if it was a game key
+    """
+    if event.type == pygame.KEYDOWN:
+      if event.key in DIRECTION_KEYS:
+        if event.key not in self.held:  # poll() may have found it already
+          self.press(event.key)
+      elif event.key == pygame.K_SPACE:
+        self.space = True
+        self.latency.pressed()
+      else:
+        return False
+      return True
+    if event.type == pygame.KEYUP and event.key in self.held:
+      self.held.remove(event.key)
+      self.tapped = event.key
+      return True
+    return False
+
+  def press(self, key):
+    if key in self.held:
+      self.held.remove(key)
+    self.held.append(key)
+    self.latency.pressed()
+
+  def poll(self):
+    """
+    Inputs for the next simulation step
+    """
+    # Catch presses that are not in the event queue yet and releases that were missed (e.g. losing focus)
+    pygame.event.pump()
+    keys = pygame.key.get_pressed()
+    for key in self.held:
+      if not keys[key]:
+        self.tapped = key  # Released before its KEYUP came in, it still counts for this step
+    self.held = [key for key in self.held if keys[key]]
+    for key in DIRECTION_KEYS:
+      if keys[key] and key not in self.held:
+        self.press(key)
+
+    if self.held:
+      direction = DIRECTION_KEYS[self.held[-1]]
+    elif self.tapped is not None:
+      direction = DIRECTION_KEYS[self.tapped]
+    else:
+      direction = 0
+    self.tapped = None
+
+    # Only changes are sent, the player keeps its velocity between them
+    inputs = 0
+    if direction != self.direction:
+      inputs = KEY_RELEASE | direction
+      self.direction = direction
+    if self.space:
+      inputs |= KEY_SPACE
+      self.space = False
+    if inputs:
+      self.latency.applied()
+    else:
+      self.latency.pending.clear()  # Presses that changed nothing never show up on screen
+    return inputs
+
+
+class LatencyLog:
+  """
+  Input-to-photon latency: time from a key press being seen to the end of the first display update
+  after the simulation step that applied it, kept for the last size presses
+  pending: times of presses that have been seen but not shown yet
+  samples: ring buffer of latencies (ms)
+  count: number of latencies recorded so far
+  """
+  def __init__(self, size=256):
+    self.size = size
+    self.pending = []
+    self.applying = []
+    self.samples = array("d", bytes(8 * size))
+    self.count = 0
+
+  def pressed(self):
+    self.pending.append(time.perf_counter())
+
+  def applied(self):
+    """
+    The pending presses went into a simulation step, they will be on screen after the next display update
+    """
+    self.applying.extend(self.pending)
+    self.pending.clear()
+
+  def presented(self):
+    """
+    Called right after the display was updated
+    """
+    now = time.perf_counter()
+    for pressed in self.applying:
+      self.samples[self.count % self.size] = (now - pressed) * 1000
+      self.count += 1
+    self.applying.clear()
+
+  def stats(self):
+    """
+    (average ms, p50 ms, p99 ms) over the recorded presses, or None if there are none
+    """
+    count = min(self.count, self.size)
+    if count == 0:
+      return None
+    samples = sorted(self.samples[:count])
+    return sum(samples) / count, samples[count // 2], samples[min(int(count * 0.99), count - 1)]
+
+  def export_csv(self, path):
+    count = min(self.count, self.size)
+    with open(path, "w") as file:
+      file.write("press,latency_ms\n")
+      for press in range(self.count - count, self.count):
+        file.write(f"{press},{self.samples[press % self.size]:.3f}\n")
@@ -0,0 +1,175 @@
+"""
+Reinforcement learning environments with the Gym reset()/step() interface, without depending on gym itself.
+QixEnv wraps one GameSim and QixVectorEnv steps several of them as a batch:
+  env = QixVectorEnv(64, seed=0)
+  observations, infos = env.reset()
+  observations, rewards, terminated, truncated, infos = env.step(actions)
+Observations are NumPy arrays that the environments update in place, nothing is copied per step. Keep a copy
+of an observation if it is needed after the next step.
+"""
+import numpy as np
+
+from sim import GameSim, KEY_LEFT, KEY_RIGHT, KEY_UP, KEY_DOWN, KEY_SPACE, KEY_RELEASE
+
+# Discrete actions: do nothing (keep moving the same way), move, or start an incursion in a direction
+ACTIONS = (0,
+           KEY_RELEASE | KEY_LEFT, KEY_RELEASE | KEY_RIGHT, KEY_RELEASE | KEY_UP, KEY_RELEASE | KEY_DOWN,
+           KEY_RELEASE | KEY_SPACE | KEY_LEFT, KEY_RELEASE | KEY_SPACE | KEY_RIGHT,
+           KEY_RELEASE | KEY_SPACE | KEY_UP, KEY_RELEASE | KEY_SPACE | KEY_DOWN)
+
+# Layout of the state vector, positions are relative to the field (0 to 1)
+STATE_FIELDS = ("player_x", "player_y", "vel_x", "vel_y", "incursion", "lives", "captured", "level")
+LIFE_PENALTY = 0.1
+
+
+class QixEnv:
+  """
+  Gym-style environment around one GameSim. The reward of a step is the fraction of the field captured
+  during it, minus LIFE_PENALTY for every life lost
+  observation_type: "state" for the state vector, or "raster" for {"grid": Map.grid of the current level
+  (1 for captured cells), "state": state vector}. The grid is the map's own occupancy, not a copy
+  max_enemies: number of enemy slots in the state vector, extra enemies are left out and unused slots are 0
+  frame_skip: frames simulated per step, the action is pressed on the first one
+  max_steps: steps after which an episode is truncated
+  state: the state vector, STATE_FIELDS followed by (x, y) of every enemy slot, updated in place every step
+  """
+  def __init__(self, levels=None, seed=None, observation_type="state", max_enemies=8, frame_skip=1,
+               max_steps=10000, enemy_backend="auto", state=None):
+    self.levels = levels
+    self.seed = seed
+    self.observation_type = observation_type
+    self.max_enemies = max_enemies
+    self.frame_skip = frame_skip
+    self.max_steps = max_steps
+    self.enemy_backend = enemy_backend
+    self.state = np.zeros(self.state_size(max_enemies), dtype=np.float32) if state is None else state
+    self.sim = None
+    self.steps = 0
+    self.episodes = 0
+
+  @staticmethod
+  def state_size(max_enemies):
+    return len(STATE_FIELDS) + 2 * max_enemies
+
+  @property
+  def action_count(self):
+    return len(ACTIONS)
+
+  def reset(self, seed=None):
+    if seed is None and self.seed is not None:
+      seed = self.seed + self.episodes  # A new game every episode, still reproducible
+    self.sim = GameSim(self.levels, enemy_backend=self.enemy_backend, seed=seed)
+    self.steps = 0
+    self.episodes += 1
+    return self.observe(), {"level": 0, "frame": 0}
+
+  def step(self, action):
+    reward, terminated, truncated, info = self.advance(action)
+    return self.observe(), reward, terminated, truncated, info
+
+  def advance(self, action):
+    """
+    step() without the observation, (reward, terminated, truncated, info)
+    """
+    sim = self.sim
+    map, lives = sim.map, sim.player.lives
+    captured = map.captured_area
+    sim.step(ACTIONS[action])
+    for _ in range(self.frame_skip - 1):
+      if sim.state != "playing" or sim.map is not map:
+        break
+      sim.step(0)
+    self.steps += 1
+
+    # A completed level has already been replaced by the next one, the capture that completed it is in the old map
+    reward = (map.captured_area - captured) / (map.size * map.size)
+    if sim.map is map:
+      reward -= LIFE_PENALTY * (lives - sim.player.lives)
+    terminated = sim.state != "playing"
+    truncated = not terminated and self.steps >= self.max_steps
+    return reward, terminated, truncated, {"level": sim.level, "frame": sim.frame}
+
+  def observe(self):
+    """
+    Write the current state into the state vector and return the observation
+    """
+    map = self.sim.map
+    self.state[:] = self.raw_state()
+    normalise(self.state[None], np.array([map.origin], dtype=np.float32), np.array([map.size], dtype=np.float32))
+    if self.observation_type == "raster":
+      return {"grid": map.grid, "state": self.state}
+    return self.state
+
+  def raw_state(self):
+    """
+    State vector as a list, before normalise(): positions in screen coordinates and the captured area in cells
+    """
+    sim = self.sim
+    map, player, enemies = sim.map, sim.player, sim.enemies
+    row = [player.x, player.y, player.vel_x, player.vel_y, player.incursion, player.lives, map.captured_area, sim.level]
+    row += enemies.positions()[:self.max_enemies].ravel().tolist()
+    # Unused slots are padded with the origin, which normalises to 0
+    row += map.origin * ((len(self.state) - len(row)) // 2)
+    return row
+
+
+def normalise(states, origins, sizes):
+  """
+  Turn raw_state() rows of states into state vectors in place, origins and sizes being those of the map of every row
+  """
+  count = len(states)
+  positions = states[:, len(STATE_FIELDS):].reshape(count, -1, 2)
+  positions -= origins[:, None]
+  positions /= sizes[:, None, None]
+  states[:, 0:2] -= origins
+  states[:, 0:2] /= sizes[:, None]
+  states[:, 6] /= sizes * sizes
+
+
+class QixVectorEnv:
+  """
+  Steps count QixEnvs as one batch. Every environment writes its state vector straight into its row of states,
+  and environments whose episode ended are reset automatically (the final info is kept under "final_info")
+  envs: the QixEnv of every row
+  states: (count, state size) float32 array of every state vector, the observation of every step in "state" mode
+  rewards, terminated, truncated: per environment results of the last step, updated in place
+  """
+  def __init__(self, count, levels=None, seed=None, observation_type="state", max_enemies=8, frame_skip=1,
+               max_steps=10000, enemy_backend="auto"):
+    self.states = np.zeros((count, QixEnv.state_size(max_enemies)), dtype=np.float32)
+    self.envs = [QixEnv(levels, None if seed is None else seed + i * 1000003, observation_type, max_enemies,
+                        frame_skip, max_steps, enemy_backend, self.states[i]) for i in range(count)]
+    self.observation_type = observation_type
+    self.rewards = np.zeros(count, dtype=np.float32)
+    self.terminated = np.zeros(count, dtype=bool)
+    self.truncated = np.zeros(count, dtype=bool)
+
+  def __len__(self):
+    return len(self.envs)
+
+  def reset(self):
+    infos = [env.reset()[1] for env in self.envs]
+    return self.observations(), infos
+
+  def step(self, actions):
+    infos = []
+    rewards, terminated, truncated = self.rewards, self.terminated, self.truncated
+    for i, (env, action) in enumerate(zip(self.envs, actions)):
+      rewards[i], terminated[i], truncated[i], info = env.advance(action)
+      if terminated[i] or truncated[i]:
+        info = {"final_info": info, **env.reset()[1]}
+      infos.append(info)
+    return self.observations(), rewards, terminated, truncated, infos
+
+  def observations(self):
+    """
+    Write the state vector of every environment in one batch and return the observations
+    """
+    envs = self.envs
+    self.states[:] = [env.raw_state() for env in envs]
+    maps = [env.sim.map for env in envs]
+    normalise(self.states, np.array([map.origin for map in maps], dtype=np.float32),
+              np.array([map.size for map in maps], dtype=np.float32))
+    if self.observation_type == "raster":
+      return {"grid": [map.grid for map in maps], "state": self.states}
+    return self.states
@@ -0,0 +1,201 @@
+"""
+Export of recorded games (see replay.py) as PNG image sequences or raw video, rendered without a window:
+  python export.py game.qxr --png frames/
+  python export.py game.qxr --raw - | ffmpeg -f rawvideo -pix_fmt rgb24 -s 600x600 -r 60 -i - game.mp4
+  python export.py game.qxr --video game.mp4
+--video starts ffmpeg itself with the arguments above. Raw frames are rgb24, one per simulation step.
+
+Every frame is drawn on an offscreen surface and copied once, straight from the surface's pixel buffer,
+into a free slot of a ring of frame buffers. Converting the pixels to RGB and encoding them (PNG compression,
+writing to the pipe) happen on worker threads, and zlib and file writes release the GIL, so encoding
+overlaps with simulating and drawing the next frames.
+"""
+import argparse
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # stdout may be the raw video
+import numpy as np
+import pygame
+
+from render import Renderer, RESOLUTION
+from replay import Recording, steps
+from sim import TICK_RATE
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class FrameSlot:
+  """
+  One frame buffer of the ring
+  pixels: (height, width, 4) copy of the surface's pixels, in the surface's own byte order
+  rows: RGB rows of the frame, each after prefix filter bytes (1 for PNG, always 0 meaning no filter, 0 for raw)
+  rgb: (height, width, 3) view of the pixels in rows
+  encoding: Future of the encoding of the frame in the slot, the slot is free again once it is done
+  """
+  def __init__(self, width, height, prefix):
+    self.pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    self.rows = np.zeros((height, prefix + 3 * width), dtype=np.uint8)
+    self.rgb = self.rows[:, prefix:].reshape(height, width, 3)
+    self.encoding = None
+
+
+class FrameExporter:
+  """
+  Copies frames from surface into a ring of FrameSlots and hands them to encode(slot, number) on worker threads.
+  A slot is only reused once its previous frame has been encoded, so at most len(slots) frames are in flight
+  channels: index of the red, green and blue bytes in a pixel of surface
+  """
+  def __init__(self, surface, encode, workers, prefix=0, ordered=False):
+    self.surface = surface
+    self.encode = encode
+    # Frames written to one stream have to be encoded in order, which one worker does
+    self.workers = 1 if ordered else workers
+    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export")
+    width, height = surface.get_size()
+    self.slots = [FrameSlot(width, height, prefix) for _ in range(2 * self.workers)]
+    shifts = surface.get_shifts()[:3]
+    self.channels = [shift // 8 if sys.byteorder == "little" else 3 - shift // 8 for shift in shifts]
+    self.frames = 0
+
+  def add(self):
+    slot = self.slots[self.frames % len(self.slots)]
+    if slot.encoding is not None:
+      slot.encoding.result()  # Also raises any error from the encoder
+    width, height = self.surface.get_size()
+    # The view locks the surface until it is released, so it is only held for the copy
+    view = self.surface.get_view("0")
+    pixels = np.frombuffer(view, dtype=np.uint8).reshape(height, -1, 4)[:, :width]
+    np.copyto(slot.pixels, pixels)
+    del pixels, view
+    slot.encoding = self.executor.submit(self.convert_and_encode, slot, self.frames)
+    self.frames += 1
+
+  def convert_and_encode(self, slot, number):
+    for i, channel in enumerate(self.channels):
+      np.copyto(slot.rgb[:, :, i], slot.pixels[:, :, channel])
+    self.encode(slot, number)
+
+  def close(self):
+    for slot in self.slots:
+      if slot.encoding is not None:
+        slot.encoding.result()
+    self.executor.shutdown()
+
+
+class PngWriter:
+  """
+  Writes every frame as directory/frame_NNNNNN.png, compressed at level (1 is fastest, 9 smallest)
+  """
+  prefix = 1
+  ordered = False
+
+  def __init__(self, directory, level=1):
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+    self.level = level
+
+  def __call__(self, slot, number):
+    height, width, _ = slot.rgb.shape
+    data = zlib.compress(slot.rows, self.level)
+    with open(os.path.join(self.directory, f"frame_{number:06d}.png"), "wb") as file:
+      file.write(PNG_SIGNATURE)
+      _write_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+      _write_chunk(file, b"IDAT", data)
+      _write_chunk(file, b"IEND", b"")
+
+
+class RawWriter:
+  """
+  Writes every frame as rgb24 bytes to stream, in order
+  """
+  prefix = 0
+  ordered = True
+
+  def __init__(self, stream):
+    self.stream = stream
+
+  def __call__(self, slot, number):
+    self.stream.write(slot.rows)
+
+
+def _write_chunk(file, kind, data):
+  file.write(struct.pack(">I", len(data)))
+  file.write(kind)
+  file.write(data)
+  file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+def ffmpeg_command(path, size, fps=TICK_RATE):
+  executable = shutil.which("ffmpeg")
+  if executable is None:
+    return None
+  return [executable, "-loglevel", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}",
+          "-r", str(fps), "-i", "-", "-pix_fmt", "yuv420p", path]
+
+
+def export(recording, writer, workers=os.cpu_count(), size=RESOLUTION):
+  """
+  Render every step of recording and pass it to writer (a PngWriter or RawWriter), returns the number of frames
+  """
+  pygame.font.init()
+  surface = pygame.Surface(size, 0, 32)
+  renderer = Renderer(surface, pygame.font.Font(None, 30))
+  exporter = FrameExporter(surface, writer, workers, writer.prefix, writer.ordered)
+  try:
+    for sim in steps(recording):
+      renderer.draw_game(sim)
+      exporter.add()
+  finally:
+    exporter.close()
+  return exporter.frames
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Render a recorded game to PNG frames or raw video")
+  parser.add_argument("recording")
+  output = parser.add_mutually_exclusive_group(required=True)
+  output.add_argument("--png", metavar="DIRECTORY", help="write every frame as a PNG file in DIRECTORY")
+  output.add_argument("--raw", metavar="FILE", help="write rgb24 frames to FILE, - for stdout")
+  output.add_argument("--video", metavar="FILE", help="encode the frames to FILE with ffmpeg")
+  parser.add_argument("--level", type=int, default=1, help="PNG compression level, 1 (fastest) to 9 (smallest)")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of encoding threads")
+  args = parser.parse_args(argv)
+  recording = Recording.load(args.recording)
+
+  process, stream = None, None
+  if args.png:
+    writer = PngWriter(args.png, args.level)
+  elif args.raw:
+    stream = sys.stdout.buffer if args.raw == "-" else open(args.raw, "wb")
+    writer = RawWriter(stream)
+  else:
+    command = ffmpeg_command(args.video, RESOLUTION)
+    if command is None:
+      parser.error("ffmpeg was not found, use --raw and pipe the frames to an encoder")
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    stream = process.stdin
+    writer = RawWriter(stream)
+
+  start = time.perf_counter()
+  frames = export(recording, writer, args.workers)
+  if stream is not None and stream is not sys.stdout.buffer:
+    stream.close()
+  if process is not None and process.wait() != 0:
+    print(f"ffmpeg failed with exit code {process.returncode}", file=sys.stderr)
+    return 1
+  elapsed = time.perf_counter() - start
+  print(f"{frames} frames in {elapsed:.2f}s ({frames / elapsed:.0f} frames/s, "
+        f"{frames / TICK_RATE / elapsed:.1f}x real time)", file=sys.stderr)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,575 @@
+import bisect
+import pygame
+import random
+import math
+import numpy as np
+
+from boundary import Boundary, signed_area
+from broadphase import SegmentGrid
+
+# A Qix keeps its centre at least this far (in the distance field) from captured territory and the field edges
+QIX_CLEARANCE = 25
+# Distances in the Map distance field stop at this. Qix only look at distances around QIX_CLEARANCE, and a capture
+# only changes the field within this many cells of the captured area, so it is kept small
+DISTANCE_CAP = 2 * QIX_CLEARANCE
+# Qix directions, indexed by random direction - 1 (randint(1, 4))
+QIX_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+# Side of the square tiles (in cells) the territory is tracked in, so drawings of it only redo the tiles that changed
+TILE_SIZE = 64
+# Colours of open cells, captured cells (and the outside of the field) and the outlines between them
+TERRITORY_COLOURS = ("beige", "white", "black")
+
+# CLASS DEFINITION
+
+class Map:
+  """
+  size: area of map
+  area_remaining: uncaptured area left in the map
+  captured_area: area captured so far, always size*size - area_remaining
+  complete: True if required percentage of area is captured, False otherwise
+  origin: top left corner of the field, the (0, 0) cell of occupancy
+  occupancy: one byte per unit cell of the field, row by row, 1 if the cell is captured and 0 otherwise
+  grid: (size, size) NumPy view of occupancy, indexed [row, column]
+  version: incremented every time an edge is added, so cached drawings of the map know when to rebuild
+  boundary: Boundary of the playable region, starts as init_edges and shrinks with every capture
+  distance: one byte per cell like occupancy, the distance (|rows| + |columns|, at most DISTANCE_CAP) from the
+  cell to the nearest captured cell or the outside of the field. Updated around every claimed polygon
+  distance_grid: (size, size) NumPy view of distance
+  tile_versions: version at which each TILE_SIZE square of cells last changed, indexed [tile row, tile column]
+  """
+  def __init__(self, size, init_edges, init_player, init_enemies, target_area):
+    self.size = size
+    self.area_remaining = size*size
+    self.captured_area = 0
+    self.origin = (min(point[0] for point in init_edges), min(point[1] for point in init_edges))
+    self.occupancy = bytearray(size*size)
+    self.grid = np.frombuffer(self.occupancy, dtype=np.uint8).reshape(size, size)
+    self.distance = bytearray(size*size)
+    self.distance_grid = np.frombuffer(self.distance, dtype=np.uint8).reshape(size, size)
+    # Nothing is captured yet, every cell is as far as the nearest side of the field
+    cells = np.arange(size)
+    to_side = np.minimum(np.minimum(cells + 1, size - cells), DISTANCE_CAP).astype(np.uint8)
+    np.minimum(to_side[:, None], to_side[None, :], out=self.distance_grid)
+    self.version = 0
+    tiles = -(-size // TILE_SIZE)
+    self.tile_versions = np.zeros((tiles, tiles), dtype=np.int32)
+    self.boundary = Boundary(init_edges)
+    self.init_player = init_player
+    self.enemies = init_enemies
+    self.target = target_area
+    self.complete = False
+
+  def draw(self, surface, view, rect=None):
+    """
+    Draw the territory in rect (the whole surface if None) from the occupancy, every pixel in the colour of the cell
+    under its centre and black where captured and open cells meet. The work depends on the pixels drawn, not on
+    the size of the field or the number of captured polygons
+    view: render.View, where the field goes on surface
+    """
+    rect = surface.get_rect() if rect is None else rect.clip(surface.get_rect())
+    if not rect:
+      return
+    # One pixel more on every side, whether a pixel is an outline depends on its neighbours
+    xs = np.arange(rect.left - 1, rect.right + 1) + 0.5
+    ys = np.arange(rect.top - 1, rect.bottom + 1) + 0.5
+    cols = np.floor((xs - view.offset[0]) / view.scale - self.origin[0]).astype(np.intp)
+    rows = np.floor((ys - view.offset[1]) / view.scale - self.origin[1]).astype(np.intp)
+    # Pixels go the same way as cells, so the pixels inside the field are one block of rows and columns
+    inside_cols = np.flatnonzero((cols >= 0) & (cols < self.size))
+    inside_rows = np.flatnonzero((rows >= 0) & (rows < self.size))
+    captured = np.ones((len(ys), len(xs)), dtype=bool)
+    if len(inside_cols) and len(inside_rows):
+      cells = self.grid.take(rows[inside_rows], 0).take(cols[inside_cols], 1)
+      np.not_equal(cells, 0, out=captured[inside_rows[0]:inside_rows[-1] + 1, inside_cols[0]:inside_cols[-1] + 1])
+
+    outline = np.zeros_like(captured)
+    across = captured[:, 1:] != captured[:, :-1]
+    outline[:, 1:] |= across
+    outline[:, :-1] |= across
+    down = captured[1:] != captured[:-1]
+    outline[1:] |= down
+    outline[:-1] |= down
+    kinds = np.where(outline, 2, captured.view(np.uint8))[1:-1, 1:-1]  # Index into TERRITORY_COLOURS
+    colours = np.array([surface.map_rgb(pygame.Color(colour)) for colour in TERRITORY_COLOURS], dtype=np.uint32)
+    pygame.surfarray.blit_array(surface.subsurface(rect), colours.take(kinds).T)
+
+  def claim(self, edge, area, cut=None):
+    """
+    Account for edge, a captured polygon whose cells have already been marked, area of them newly captured.
+    cut: the part of edge's outline that went through the open region (all of it if None). The rest of the outline
+    runs along territory that was already captured, so only open cells near cut can get closer to captured cells
+    """
+    top, left, bottom, right = self.cell_bounds(edge)
+    # Inside the polygon the cells are captured now, whatever their distance was
+    distances = self.distance_grid[top:bottom, left:right]
+    distances[self.grid[top:bottom, left:right] != 0] = 0
+    self.update_distance(*self.cell_bounds(edge if cut is None else cut))
+    self.version += 1
+    top, left, bottom, right = self.tile_bounds(edge)
+    self.tile_versions[top // TILE_SIZE:-(-bottom // TILE_SIZE), left // TILE_SIZE:-(-right // TILE_SIZE)] = self.version
+    self.area_remaining -= area
+    self.captured_area += area
+    if self.captured_area >= (self.size**2)*self.target:
+      self.complete = True
+
+  def capture(self, path, qix_points):
+    """
+    Cut the playable region in two along an incursion path and capture the side without a Qix in it (the smaller
+    side if neither has one). A side with a Qix in it always stays open, so if both have one nothing is captured.
+    Returns True if a side was captured. Only the smaller side is rasterised, over the tiles it covers, and the other
+    side is the rest of the open cells, so a small capture does not touch the rest of the grid
+    """
+    polygons = self.boundary.split(path)
+    # Every open cell is on one side or the other, so whichever side is rasterised the counts of both are exact
+    small = 0 if abs(signed_area(polygons[0])) <= abs(signed_area(polygons[1])) else 1
+    top, left, bottom, right = self.tile_bounds(polygons[small])
+    inside = self.rasterise(polygons[small], top, left, bottom, right)
+    inside &= self.grid[top:bottom, left:right] == 0
+
+    points = np.array(qix_points, dtype=float).reshape(-1, 2)
+    cols = np.clip((points[:, 0] - self.origin[0]).astype(np.intp), 0, self.size - 1)
+    rows = np.clip((points[:, 1] - self.origin[1]).astype(np.intp), 0, self.size - 1)
+    in_tiles = (rows >= top) & (rows < bottom) & (cols >= left) & (cols < right)
+    in_small = np.zeros(len(points), dtype=bool)
+    in_small[in_tiles] = inside[rows[in_tiles] - top, cols[in_tiles] - left]
+    has_qix = [False, False]
+    has_qix[small] = bool(in_small.any())
+    has_qix[1 - small] = bool((~in_small & (self.grid[rows, cols] == 0)).any())
+    if all(has_qix):
+      return False
+    areas = [0, 0]
+    areas[small] = int(np.count_nonzero(inside))
+    areas[1 - small] = self.area_remaining - areas[small]
+    kept = 0 if (has_qix[0], areas[0]) > (has_qix[1], areas[1]) else 1
+
+    if kept == small:
+      # The big side is every open cell that is not on the small side, all inside the tiles of the boundary
+      outer_top, outer_left, outer_bottom, outer_right = self.tile_bounds(self.boundary.points)
+      cells = self.grid[outer_top:outer_bottom, outer_left:outer_right]
+      captured = cells == 0
+      captured[top - outer_top:bottom - outer_top, left - outer_left:right - outer_left] &= ~inside
+    else:
+      cells, captured = self.grid[top:bottom, left:right], inside
+    np.bitwise_or(cells, captured, out=cells)
+    self.boundary = Boundary(polygons[kept])
+    self.claim(polygons[1 - kept], areas[1 - kept], path)
+    return True
+
+  def rasterise(self, polygon, top=0, left=0, bottom=None, right=None):
+    """
+    Boolean array of the cells in rows top:bottom and columns left:right (the whole field by default) whose centre
+    is inside polygon, a rectilinear polygon.
+    Inside only changes on the rows of horizontal sides, so each band of rows between two of them is worked out once
+    (every side flips the columns it covers for the rows below it) and then repeated down the band. Sides above the
+    window flip its first row, and the ones below it or beside it do not change anything in it
+    """
+    bottom = self.size if bottom is None else bottom
+    right = self.size if right is None else right
+    x0, y0 = self.origin
+    sides = []
+    n = len(polygon)
+    for i in range(n):
+      (x1, y1), (x2, y2) = polygon[i], polygon[(i + 1) % n]
+      if y1 == y2 and x1 != x2:
+        row = min(max(math.ceil(y1 - y0 - 0.5), top), bottom) - top
+        start = min(max(math.ceil(min(x1, x2) - x0 - 0.5), left), right) - left
+        end = min(max(math.ceil(max(x1, x2) - x0 - 0.5), left), right) - left
+        sides.append((row, start, end))
+    rows = sorted({side[0] for side in sides})
+    flips = np.zeros((len(rows), right - left), dtype=np.uint8)
+    for row, start, end in sides:
+      flips[bisect.bisect_left(rows, row), start:end] ^= 1
+    bands = np.bitwise_xor.accumulate(flips, axis=0).view(bool)
+    inside = np.zeros((bottom - top, right - left), dtype=bool)
+    inside[rows[0]:rows[-1]] = np.repeat(bands[:-1], np.diff(rows), axis=0)
+    return inside
+
+  def cell_bounds(self, points):
+    """
+    (top, left, bottom, right) rows and columns of the cells covered by the bounding box of points, clipped to the field
+    """
+    xs = [point[0] - self.origin[0] for point in points]
+    ys = [point[1] - self.origin[1] for point in points]
+    top, left = max(math.floor(min(ys)), 0), max(math.floor(min(xs)), 0)
+    bottom, right = min(math.ceil(max(ys)), self.size), min(math.ceil(max(xs)), self.size)
+    return top, left, bottom, right
+
+  def tile_bounds(self, points):
+    """
+    cell_bounds of points rounded out to whole TILE_SIZE tiles, clipped to the field
+    """
+    top, left, bottom, right = self.cell_bounds(points)
+    return (top // TILE_SIZE * TILE_SIZE, left // TILE_SIZE * TILE_SIZE,
+            min(-(-bottom // TILE_SIZE) * TILE_SIZE, self.size), min(-(-right // TILE_SIZE) * TILE_SIZE, self.size))
+
+  def update_distance(self, top, left, bottom, right):
+    """
+    Bring the distance field up to date after the cells in rows top:bottom and columns left:right changed.
+    Only cells closer than DISTANCE_CAP to those can get closer to captured territory, so only they are recomputed
+    """
+    size = self.size
+    top, left = max(top - DISTANCE_CAP, 0), max(left - DISTANCE_CAP, 0)
+    bottom, right = min(bottom + DISTANCE_CAP, size), min(right + DISTANCE_CAP, size)
+    if top >= bottom or left >= right:
+      return
+    window = self.distance_grid[top:bottom, left:right]
+    np.minimum(window, distance_transform(self.grid[top:bottom, left:right] != 0, DISTANCE_CAP), out=window,
+               casting="unsafe")
+
+  def distance_at(self, x, y):
+    """
+    Distance field at the point (x, y), 0 outside the field
+    """
+    col = int(x - self.origin[0])
+    row = int(y - self.origin[1])
+    if x < self.origin[0] or y < self.origin[1] or col >= self.size or row >= self.size:
+      return 0
+    return self.distance[row * self.size + col]
+
+  def is_captured(self, x, y):
+    """
+    True if the point (x, y) is on a captured cell. Points outside the field count as captured
+    """
+    col = int(x - self.origin[0])
+    row = int(y - self.origin[1])
+    if x < self.origin[0] or y < self.origin[1] or col >= self.size or row >= self.size:
+      return True
+    return self.occupancy[row * self.size + col] == 1
+
+class Player:
+  """
+  path: trail of the current incursion as a polyline, only the start point, turning points and current position are kept
+  trail_grid: broadphase grid over the segments of path, kept in sync by extend_path
+  arc: position along the boundary (Boundary arc length) while on it, and where the incursion started during one.
+  None until it is first looked up
+  swept: area covered by the hitbox during the last move, used for enemy collisions so a move cannot skip over an enemy
+  colour: colour the renderer draws the player in
+  """
+  __slots__ = ("lives", "x", "y", "radius", "vel_x", "vel_y", "incursion", "path", "trail_grid", "hitbox", "swept",
+               "invincible", "arc")
+  colour = "forestgreen"
+
+  def __init__(self, lives, x, y, vel_x, vel_y):
+    self.lives = lives
+    self.x = x
+    self.y = y
+    self.radius = 10
+    self.vel_x = vel_x
+    self.vel_y = vel_y
+    self.incursion = False
+    self.path = []
+    self.trail_grid = SegmentGrid()
+    self.hitbox = pygame.Rect(x-10, y-10, 2*self.radius, 2*self.radius)
+    self.swept = self.hitbox.copy()
+    self.invincible = 0
+    self.arc = None
+
+  def move(self, map, enemies):
+    self.swept.update(self.x-10, self.y-10, 2*self.radius, 2*self.radius)
+    boundary = map.boundary
+    step_x, step_y = _sign(self.vel_x) * 5, _sign(self.vel_y) * 5
+
+    if self.incursion:
+      #free movement inside the playable region, along one axis
+      if step_x:
+        step_y = 0
+      if step_x or step_y:
+        start = (self.x, self.y)
+        end = (self.x + step_x, self.y + step_y)
+        blocked = False
+        if len(self.path) == 1:
+          # Leaving the boundary, the first step has to go inwards and not along or out of the boundary
+          middle = (self.x + step_x / 2, self.y + step_y / 2)
+          blocked = len(boundary.edges_at(*middle)) > 0 or not boundary.contains(*middle)
+        hit = boundary.first_hit(start, end)
+        if hit is not None:
+          end = hit
+        if not blocked and not self.crosses_path(start, end):
+          self.x, self.y = end
+          self.extend_path(end)  # Add position to path
+          if hit is not None:
+            self.end_incursion(map, enemies)
+
+    else:
+      #walk along the boundary in the pressed direction, if the boundary goes that way
+      if self.arc is None:
+        self.arc = boundary.arc_at(self.x, self.y)
+      for direction in ((_sign(step_x), 0), (0, _sign(step_y))):
+        found = boundary.heading(self.arc, *direction) if direction != (0, 0) else None
+        if found is not None:
+          sign, to_corner = found
+          self.arc = (self.arc + sign * min(5, to_corner)) % boundary.perimeter
+          self.x, self.y, _ = boundary.point_at(self.arc)
+          if to_corner <= 5:
+            # Stop at corners, a new direction has to be pressed to go round them
+            self.vel_x = 0
+            self.vel_y = 0
+          break
+    self.hitbox.update(self.x-10, self.y-10, 2*self.radius, 2*self.radius)
+    # Moves are along one axis, so the hitboxes before and after the move cover everything in between
+    self.swept.union_ip(self.hitbox)
+
+  def crosses_path(self, start, end):
+    """
+    True if the move from start (the end of the trail) to end would touch the trail anywhere else.
+    Trail segments and moves are axis-aligned, so they touch exactly when their bounding boxes do
+    """
+    grid = self.trail_grid
+    if grid.bounds is None:
+      return False
+    # Start half a pixel along the move so the trail segment ending at start is not counted
+    x1 = start[0] + _sign(end[0] - start[0]) * 0.5
+    y1 = start[1] + _sign(end[1] - start[1]) * 0.5
+    low_x, high_x = min(x1, end[0]), max(x1, end[0])
+    low_y, high_y = min(y1, end[1]), max(y1, end[1])
+    query = pygame.Rect(math.floor(low_x), math.floor(low_y), math.ceil(high_x - low_x) + 1, math.ceil(high_y - low_y) + 1)
+    for i in grid.query(query):
+      (ax, ay), (bx, by) = grid.segments[i]
+      if min(ax, bx) <= high_x and max(ax, bx) >= low_x and min(ay, by) <= high_y and max(ay, by) >= low_y:
+        return True
+    return False
+
+  def extend_path(self, point):
+    """
+    Add point to the end of the incursion trail. While the player keeps going in the same direction
+    the last segment is stretched to point instead of adding a new one, and standing still adds nothing
+    """
+    path = self.path
+    last_x, last_y = path[-1]
+    dx, dy = point[0] - last_x, point[1] - last_y
+    if dx == 0 and dy == 0:
+      return
+    if len(path) > 1:
+      prev_dx, prev_dy = last_x - path[-2][0], last_y - path[-2][1]
+      # Same direction if the cross product is 0 (collinear) and the dot product is positive (not turning back)
+      if prev_dx * dy == prev_dy * dx and prev_dx * dx + prev_dy * dy > 0:
+        path[-1] = point
+        self.trail_grid.stretch_last(point)
+        return
+    path.append(point)
+    self.trail_grid.add(path[-2], point)
+
+  def end_incursion(self, map, enemies):
+    self.incursion = False
+    self.vel_x = 0
+    self.vel_y = 0
+    map.capture(self.path, enemies.qix_positions())
+    self.path = []
+    self.arc = map.boundary.arc_at(self.x, self.y)
+
+  def draw_trail(self, surface, view, position=None):
+    """
+    Draw the trail of the current incursion and return its rect, or None if there is no trail.
+    view: render.View, where the field goes on surface
+    position: where the player is drawn instead of (x, y), for rendering between two simulation steps
+    """
+    if not self.incursion or len(self.path) < 2:
+      return None
+    # The trail ends at the player
+    end = (self.x, self.y) if position is None else position
+    return pygame.draw.lines(surface, "red", False, view.points(self.path[:-1] + [end]), 2)
+
+  def update(self, map: Map, enemies):
+    self.move(map, enemies)
+    if self.invincible == 0:
+      if self.incursion:
+        if self.is_touching_enemy(enemies) or self.is_touching_path(enemies):
+          self.x = self.path[0][0]
+          self.y = self.path[0][1]
+          self.incursion = False
+          self.path = []
+          self.lose_life()
+          self.invincible += 1
+      elif self.is_touching_enemy(enemies):
+        self.lose_life()
+        self.invincible += 1
+    elif 0 < self.invincible < 50:
+      self.invincible += 1
+    elif self.invincible == 50:
+      self.invincible = 0
+
+  def start_incursion(self):
+    self.incursion = True
+    self.path = [(self.x, self.y)]  # Start path at current position
+    self.trail_grid.clear()
+
+  def is_touching_path(self, enemies):
+    # Check if any enemies are touching an active incursion
+    return enemies.collide_trail(self.trail_grid)
+
+  def is_touching_enemy(self, enemies):
+    return enemies.collide_rect(self.swept)
+
+  def is_touching_corner(self, corners):
+    # Should check if the player has reach an intersection
+    pass
+  
+  def lose_life(self):
+    if self.lives > 0:
+      self.lives -= 1
+
+
+class Qix:
+  """
+  rng: random stream used to pick directions, seeded per Qix by GameSim so runs can be replayed
+  """
+  __slots__ = ("x", "y", "vel_x", "vel_y", "radius", "hitbox", "_moving", "rng")
+  colour = "red"
+
+  def __init__(self, x, y):
+    self.x = x
+    self.y = y
+    self.vel_x = 0
+    self.vel_y = 0
+    self.radius = 10
+    self.hitbox = pygame.Rect(x-self.radius, y-self.radius, 2*self.radius, 2*self.radius)
+    self._moving = 0
+    self.rng = random.Random()
+
+  def move(self, map):
+    if self._moving == 0:
+      self._moving = int((self.rng.random() + 1) * 30)
+      direction = self.rng.randint(1, 4)
+      if direction == 1:
+        self.vel_x = 1
+        self.vel_y = 0
+      elif direction == 2:
+        self.vel_x = -1
+        self.vel_y = 0
+      elif direction == 3:
+        self.vel_y = 1
+        self.vel_x = 0
+      else: 
+        self.vel_y = -1
+        self.vel_x = 0
+
+    # Stay QIX_CLEARANCE away from captured territory. Moves that do not keep that clearance are only allowed
+    # if they lead further from it, so a Qix that a capture left too close works its way back out
+    here = map.distance_at(self.x, self.y)
+    ahead = map.distance_at(self.x + self.vel_x, self.y + self.vel_y)
+    if ahead < QIX_CLEARANCE and ahead <= here:
+      # Bounce towards the most open direction and pick a new random direction next frame
+      x, y = self.x, self.y
+      self.vel_x, self.vel_y = max(QIX_DIRECTIONS, key=lambda step: map.distance_at(x + step[0], y + step[1]))
+      ahead = map.distance_at(x + self.vel_x, y + self.vel_y)
+      self._moving = 1
+    if ahead >= QIX_CLEARANCE or ahead > here:
+      self.x += self.vel_x
+      self.y += self.vel_y
+
+    self._moving -= 1
+    self.hitbox.update(self.x-self.radius, self.y-self.radius, 2*self.radius, 2*self.radius)
+
+  def update(self, map, player):
+    self.move(map)
+
+
+class Sparc:
+  """
+  Travels along the boundary of the playable region, turning at its corners
+  arc: position along the boundary (Boundary arc length)
+  direction: 1 if it travels in the order of the boundary points, -1 if against it
+  boundary: Boundary the Sparc was placed on, when the map's boundary is replaced it is placed on the new one
+  """
+  __slots__ = ("x", "y", "vel_x", "vel_y", "radius", "horizontal", "hitbox", "_speed", "arc", "direction", "boundary")
+  colour = "purple"
+
+  def __init__(self, x, y, starting_segment, init_vel):
+    self.x = x
+    self.y = y
+    self.vel_x = init_vel
+    self.vel_y = init_vel
+    self.radius = 10
+    self.horizontal = True if starting_segment in [0, 2] else False
+    self.hitbox = pygame.Rect(x-self.radius, y-self.radius, 2*self.radius, 2*self.radius)
+    self._speed = 1
+    self.arc = 0
+    self.direction = 1
+    self.boundary = None
+
+  # Which way to move along the boundary (towards the player or not)
+  def is_chasing(self, player: Player, perimeter):
+    return chase_direction(self.arc, player.arc, perimeter)
+
+  def move(self, map, player: Player):
+    boundary = map.boundary
+    if self.boundary is not boundary:
+      if self.boundary is not None:
+        # Keep going the same way on screen as on the old boundary
+        _, _, index = self.boundary.point_at(self.arc)
+        self.vel_x, self.vel_y = (self.direction * t for t in self.boundary.tangents[index])
+      self.arc, self.direction = place_on_boundary(boundary, self.x, self.y, self.vel_x, self.vel_y, self.horizontal)
+      self.boundary = boundary
+
+    direction = self.is_chasing(player, boundary.perimeter)
+    if direction != None:
+      self.direction = direction
+
+    self.arc = (self.arc + self.direction * self._speed) % boundary.perimeter
+    self.x, self.y, _ = boundary.point_at(self.arc)
+    self.hitbox.update(self.x-self.radius, self.y-self.radius, 2*self.radius, 2*self.radius)
+
+  def update(self, map, player):
+    self.move(map, player)
+
+
+# HELPER FUNCTIONS
+
+def distance_transform(cells, cap):
+  """
+  For every cell of the boolean 2D array cells, |rows| + |columns| to the nearest True cell, at most cap.
+  The distance is worked out along rows and then along columns, and along a line the distance to the nearest
+  source before each cell is index + the running minimum of (distance - index), and the same backwards
+  """
+  # int16 holds every index of a map and halves the memory the passes go through, which is most of their time
+  distance = np.where(cells, 0, cap).astype(np.int16)
+  backward = np.empty_like(distance)
+  for axis in (1, 0):
+    shape = [1, 1]
+    shape[axis] = -1
+    index = np.arange(distance.shape[axis], dtype=np.int16).reshape(shape)
+    np.add(distance, index, out=backward)
+    flipped = np.flip(backward, axis)
+    np.minimum.accumulate(flipped, axis=axis, out=flipped)
+    backward -= index
+    distance -= index
+    np.minimum.accumulate(distance, axis=axis, out=distance)
+    distance += index
+    np.minimum(distance, backward, out=distance)
+  return np.minimum(distance, cap, out=distance)
+
+
+def place_on_boundary(boundary, x, y, vel_x, vel_y, horizontal):
+  """
+  Put a Sparc at (x, y) moving with (vel_x, vel_y) on boundary, moving it to the closest point if it is not on it.
+  Returns (arc, direction), preferring a horizontal edge at corners if horizontal
+  """
+  edges = boundary.edges_at(x, y)
+  if not edges:
+    x, y, _ = boundary.nearest(x, y)
+    edges = boundary.edges_at(x, y)
+  arc = boundary.arc_at(x, y)
+  edges = sorted(edges, key=lambda index: (boundary.tangents[index][1] == 0) != horizontal)
+  for index in edges:
+    dx, dy = boundary.tangents[index]
+    along = dx * vel_x + dy * vel_y
+    if along != 0:
+      return arc, _sign(along)
+  return arc, 1
+
+
+def chase_direction(arc, target, perimeter, range=100):
+  """
+  Direction (1 or -1) of the shortest way round the boundary from arc to target, or None if target is further
+  than range along the boundary or not known
+  """
+  if target is None:
+    return None
+  ahead = (target - arc) % perimeter
+  if ahead == 0 or min(ahead, perimeter - ahead) > range:
+    return None
+  return 1 if ahead <= perimeter - ahead else -1
+
+
+def _sign(value):
+  return (value > 0) - (value < 0)
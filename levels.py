@@ -0,0 +1,168 @@
+import json
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from boundary import Boundary
+from game import Map, Player, Qix, Sparc
+
+MAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps")
+# Level files are named by their number, other files next to them are left alone
+LEVEL_NAME = re.compile(r"level(\d+)\.json")
+
+# Immutable description of a level, loaded and validated once. Everything in it is a tuple or a number,
+# so specs can be shared freely and build_map() never has to copy anything
+LevelSpec = namedtuple("LevelSpec", "size corners player enemies target captured boundary")
+PlayerSpec = namedtuple("PlayerSpec", "lives x y segment")
+EnemySpec = namedtuple("EnemySpec", "type x y segment vel")
+
+
+def parse_spec(data, name="level"):
+  """
+  Validate a level loaded from JSON (a dict) and return it as a LevelSpec. Raises ValueError if it is not a valid level
+  size: side of the square field
+  corners: [bottom left, top left, top right, bottom right] corners of the field
+  player: {"lives", "x", "y", "segment"}, segment is the side the player starts on (0 -> bottom, 1 -> left, 2 -> top, 3 -> right)
+  enemies: list of {"type": "qix", "x", "y"} and {"type": "sparc", "x", "y", "segment", "vel"}
+  target: fraction of the field to capture to complete the level
+  captured: optional list of polygons that start out captured. Each is cut away from the playable region in turn,
+  so it has to sit on the edge of what is left of it (see Boundary.cut_off), and the player and Qix have to stay
+  on the edge and inside of the region left. The corners of that region are kept as the spec's boundary
+  """
+  def check(condition, message):
+    if not condition:
+      raise ValueError(f"{name}: {message}")
+
+  def point(value, what):
+    check(isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(v, (int, float)) for v in value),
+          f"{what} must be an [x, y] pair")
+    return (value[0], value[1])
+
+  check(isinstance(data, dict), "level must be a JSON object")
+  for key in ("size", "corners", "player", "enemies", "target"):
+    check(key in data, f"missing {key!r}")
+
+  size = data["size"]
+  check(isinstance(size, int) and size > 0, "size must be a positive integer")
+  check(isinstance(data["corners"], list) and len(data["corners"]) == 4, "corners must list 4 corners")
+  corners = tuple(point(corner, "corner") for corner in data["corners"])
+  (left, bottom), (_, top), (right, _) = corners[0], corners[1], corners[2]
+  check(corners == ((left, bottom), (left, top), (right, top), (right, bottom)),
+        "corners must be bottom left, top left, top right, bottom right of a rectangle")
+  check(right - left == size and bottom - top == size, "corners must be size apart")
+
+  def on_side(x, y, segment):
+    return [y == bottom and left <= x <= right, x == left and top <= y <= bottom,
+            y == top and left <= x <= right, x == right and top <= y <= bottom][segment]
+
+  player = data["player"]
+  check(isinstance(player, dict), "player must be an object")
+  x, y = point((player.get("x"), player.get("y")), "player position")
+  player = PlayerSpec(player.get("lives"), x, y, player.get("segment"))
+  check(isinstance(player.lives, int) and player.lives > 0, "player lives must be a positive integer")
+  check(player.segment in (0, 1, 2, 3), "player segment must be 0, 1, 2 or 3")
+  check(on_side(player.x, player.y, player.segment), "player must start on its segment")
+
+  enemies = []
+  check(isinstance(data["enemies"], list), "enemies must be a list")
+  for enemy in data["enemies"]:
+    check(isinstance(enemy, dict) and enemy.get("type") in ("qix", "sparc"), "enemy type must be 'qix' or 'sparc'")
+    x, y = point((enemy.get("x"), enemy.get("y")), "enemy position")
+    if enemy["type"] == "qix":
+      check(left < x < right and top < y < bottom, "qix must start inside the field")
+      enemies.append(EnemySpec("qix", x, y, None, None))
+    else:
+      check(enemy.get("segment") in (0, 1, 2, 3), "sparc segment must be 0, 1, 2 or 3")
+      check(enemy.get("vel") in (-1, 1), "sparc vel must be -1 or 1")
+      check(on_side(x, y, enemy["segment"]), "sparc must start on its segment")
+      enemies.append(EnemySpec("sparc", x, y, enemy["segment"], enemy["vel"]))
+
+  target = data["target"]
+  check(isinstance(target, (int, float)) and 0 < target < 1, "target must be between 0 and 1")
+
+  captured = []
+  check(isinstance(data.get("captured", []), list), "captured must be a list of polygons")
+  for polygon in data.get("captured", []):
+    check(isinstance(polygon, (list, tuple)) and len(polygon) >= 3, "captured polygons need at least 3 points")
+    captured.append(tuple(point(p, "captured point") for p in polygon))
+
+  # Check the captured polygons can be folded into the boundary the way build_map() will
+  boundary = Boundary(list(corners))
+  for i, polygon in enumerate(captured):
+    try:
+      boundary = Boundary(boundary.cut_off(polygon))
+    except ValueError as error:
+      check(False, f"captured polygon {i}: {error}")
+  check(len(boundary.edges_at(player.x, player.y)) > 0, "player must start on the edge of the uncaptured region")
+  for enemy in enemies:
+    if enemy.type == "qix":
+      check(boundary.contains(enemy.x, enemy.y), "qix must start in the uncaptured region")
+
+  return LevelSpec(size, corners, player, tuple(enemies), target, tuple(captured), tuple(boundary.points))
+
+
+def load_spec(path):
+  with open(path) as file:
+    return parse_spec(json.load(file), os.path.basename(path))
+
+
+def load_specs(directory=MAP_DIR):
+  """
+  Load every level<number>.json in directory, in level order
+  """
+  matches = [LEVEL_NAME.fullmatch(name) for name in os.listdir(directory)]
+  names = sorted((int(match.group(1)), match.group(0)) for match in matches if match)
+  return [load_spec(os.path.join(directory, name)) for _, name in names]
+
+
+def build_map(spec: LevelSpec):
+  """
+  Build fresh runtime state (Map, Player and enemies) for a level
+  """
+  player = Player(spec.player.lives, spec.player.x, spec.player.y, 0, 0)
+  enemies = [Qix(enemy.x, enemy.y) if enemy.type == "qix" else Sparc(enemy.x, enemy.y, enemy.segment, enemy.vel)
+             for enemy in spec.enemies]
+  map = Map(spec.size, spec.corners, player, enemies, spec.target)
+  # The captured polygons were cut away from the boundary when the spec was parsed
+  for polygon in spec.captured:
+    top, left, bottom, right = map.cell_bounds(polygon)
+    cells = map.grid[top:bottom, left:right]
+    inside = map.rasterise(polygon, top, left, bottom, right)
+    inside &= cells == 0
+    np.bitwise_or(cells, inside, out=cells)
+    map.claim(list(polygon), int(np.count_nonzero(inside)))
+  map.boundary = Boundary(list(spec.boundary))
+  return map
+
+
+class LevelPreloader:
+  """
+  Builds maps on a background thread ahead of time, so that resetting the level after a death or moving on
+  to the next level does not stall the frame it happens on
+  specs: list of LevelSpec, indexed by level
+  pending: level -> Future of a map being (or already) built for it
+  """
+  executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="level-preload")
+
+  def __init__(self, specs):
+    self.specs = specs
+    self.pending = {}
+
+  def prepare(self, level):
+    if 0 <= level < len(self.specs) and level not in self.pending:
+      self.pending[level] = self.executor.submit(build_map, self.specs[level])
+
+  def get(self, level):
+    """
+    Return a fresh map for level, using the one built in the background if it was prepared
+    """
+    future = self.pending.pop(level, None)
+    if future is None:
+      return build_map(self.specs[level])
+    return future.result()
+
+
+level_specs = load_specs()
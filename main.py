@@ -1,653 +1,157 @@
-import pygame
-import random
-import math
-import copy
-
-# CLASS DEFINITION
-
-class Map:
-  """
-  size: area of map
-  edges: list containing tuples, where each tuple contains points corresponding to the corners of each edge
-  area_remaining: uncaptured area left in the map
-  complete: True if required percentage of area is captured, False otherwise
-  """
-  def __init__(self, size, init_edges, init_player, init_enemies, target_area):
-    self.size = size
-    self.edges = [init_edges]
-    self.area_remaining = size*size
-    self.init_player = init_player
-    self.enemies = init_enemies
-    self.target = target_area
-    self.complete = False
-
-  def draw(self, surface):
-    pygame.draw.polygon(surface, "beige", self.edges[0], 0)
-    pygame.draw.lines(surface, "black", True, self.edges[0], 2)
-    for edge in self.edges[1:]:
-      pygame.draw.polygon(surface, "white", edge, 0)
-      pygame.draw.lines(surface, "black", False, edge, 2)
-    return
-
-  def add_edge(self, edge):
-    self.edges.append(edge)
-    max_x, min_x, max_y, min_y = 0, 1000, 0, 1000
-    # Find the corners of the incursion
-    for i in range(len(edge)):
-      if edge[i][0] < min_x:
-        min_x = edge[i][0]
-      elif edge[i][0] > max_x:
-        max_x = edge[i][0]
-      elif edge[i][1] < min_y:
-        min_y = edge[i][1]
-      elif edge[i][1] > max_y:
-        max_y = edge[i][1]
-    dx = max_x - min_x
-    dy = max_y - min_y
-    area = dx * dy
-    self.area_remaining -= area
-    if self.area_remaining <= (self.size**2)*self.target:
-      self.complete = True
-
-class Player:
-  """
-  edge_type: which segment the player is on. 0 -> bottom, 1 -> left, 2 -> top, 3 -> right
-  """
-  def __init__(self, lives, x, y, vel_x, vel_y, starting_segment):
-    self.lives = lives
-    self.x = x
-    self.y = y
-    self.radius = 10
-    self.vel_x = vel_x
-    self.vel_y = vel_y
-    self.incursion = False
-    self.path = []
-    self.segment = starting_segment
-    self.horizontal = True if starting_segment in [0, 2] else False
-    self.hitbox = pygame.Rect(x-10, y-10, 2*self.radius, 2*self.radius)
-    self.invincible = 0
-
-  def move(self, map_edges):
-    current_edge = map_edges[0]
-    min_x, max_x = map_edges[0][0][0], map_edges[0][2][0]
-    min_y, max_y = map_edges[0][2][1], map_edges[0][0][1]
-
-    #apply vel of 5 with bounds
-    if self.incursion:
-      #free movement
-      self.x += self.vel_x * 5
-      self.y += self.vel_y * 5
-      self.path.append((self.x, self.y))  # Add position to path
-      self.x = max(min_x, min(max_x, self.x))
-      self.y = max(min_y, min(max_y, self.y))
-
-      # Check if touching an edge
-      for i in range(len(current_edge)):
-        segment = (current_edge[i], current_edge[(i + 1) % len(current_edge)])
-        if is_between((self.x, self.y), segment) and (self.x, self.y) != self.path[0]:  # Not the start point
-          #print(f"Hit edge at {self.x, self.y} on segment {segment}")
-          self.end_incursion(map_edges, segment)
-          break
-                
-    else:
-      if self.segment == 0 or self.segment == 2:  #Bottom or Top (horizontal)
-        self.x += self.vel_x * 5
-        if not is_between((self.x, self.y), (current_edge[self.segment], current_edge[(self.segment + 1) % 4])):
-          self.y = max_y if self.segment == 0 else min_y
-        if self.x <= min_x:
-          self.x = min_x
-          self.handle_corner(map_edges)
-        elif self.x >= max_x:
-          self.x = max_x
-          self.handle_corner(map_edges)
-      elif self.segment == 1 or self.segment == 3:  #Left or Right (vertical)
-        self.y += self.vel_y * 5
-        if not is_between((self.x, self.y), (current_edge[self.segment], current_edge[(self.segment + 1) % 4])):
-          self.x = min_x if self.segment == 1 else max_x
-        if self.y <= min_y:
-          self.y = min_y
-          self.handle_corner(map_edges)
-        elif self.y >= max_y:
-          self.y = max_y
-          self.handle_corner(map_edges)
-    self.hitbox = pygame.Rect(self.x-10, self.y-10, 2*self.radius, 2*self.radius)
-
-  def handle_corner(self, map_edges):
-    current_edge = map_edges[0]
-    corners = current_edge
-
-    #check which corner we're at and transition
-    if self.x == corners[0][0] and self.y == corners[0][1]:  # (200, 400) - Bottom left or Left bottom
-      if self.segment == 0 and self.vel_x < 0:  # Bottom to Left
-        self.segment = 1
-        self.horizontal = False
-        self.vel_x = 0
-        self.vel_y = 0
-      if self.segment == 1 and self.vel_y > 0:  # Left to Bottom
-        self.segment = 0
-        self.horizontal = True
-        self.vel_x = 0
-        self.vel_y = 0
-    if self.x == corners[3][0] and self.y == corners[3][1]:  # (400, 400) - Bottom right or Right bottom
-        if self.segment == 0 and self.vel_x > 0:  # Bottom to Right
-          self.segment = 3
-          self.horizontal = False
-          self.vel_x = 0
-          self.vel_y = 0
-        if self.segment == 3 and self.vel_y > 0:  # Right to Bottom
-          self.segment = 0
-          self.horizontal = True
-          self.vel_x = 0
-          self.vel_y = 0
-    if self.x == corners[2][0] and self.y == corners[2][1]:  # (400, 200) - Right top or Top right
-        if self.segment == 3 and self.vel_y < 0:  # Right to Top
-          self.segment = 2
-          self.horizontal = True
-          self.vel_x = 0
-          self.vel_y = 0
-        if self.segment == 2 and self.vel_y > 0:  # Top to Right
-          self.segment = 3
-          self.horizontal = False
-          self.vel_x = 0
-          self.vel_y = 0
-    if self.x == corners[1][0] and self.y == corners[1][1]:  # (200, 200) - Top left or Left top
-        if self.segment == 2 and self.vel_x < 0:  # Top to Left
-          self.segment = 1
-          self.horizontal = False
-          self.vel_x = 0
-          self.vel_y = 0
-        if self.segment == 1 and self.vel_y < 0:  # Left to Top
-          self.segment = 2
-          self.horizontal = True
-          self.vel_x = 0
-          self.vel_y = 0
-
-  def end_incursion(self, map_edges, hit_segment):
-    start_point = self.path[0]
-    end_point = (self.x, self.y)
-    self.incursion = False
-    self.vel_x = 0
-    self.vel_y = 0
-
-    # Update segment based on hit edge
-    current_edge = map_edges[0]
-    for i in range(len(current_edge)):
-      segment = (current_edge[i], current_edge[(i + 1) % len(current_edge)])
-      if segment == hit_segment:
-        self.segment = i
-        self.horizontal = True if self.segment in [0, 2] else False
-        break
-
-    # Form new polygon
-    new_edge = self.path.copy()
-    start_idx = None
-    end_idx = None
-    for i, point in enumerate(current_edge):
-      if point == start_point:
-        start_idx = i
-      if point == end_point:
-        end_idx = i
-
-    if start_idx is not None and end_idx is not None:
-      if start_idx < end_idx:
-          edge_points = current_edge[start_idx:end_idx + 1]
-      else:
-          edge_points = current_edge[start_idx:] + current_edge[:end_idx + 1]
-      new_edge.extend(edge_points[1:])
-    else:
-      new_edge.append(start_point)
-
-    map.add_edge(new_edge)
-    self.path = []
-
-  def draw(self, surface):
-    pygame.draw.circle(surface, "forestgreen", (self.x, self.y), self.radius)
-
-    if self.incursion and len(self.path) > 1:
-      pygame.draw.lines(surface, "red", False, self.path, 2)
-
-  def update(self, surface, map: Map, enemies):
-    self.move(map.edges)
-    if self.invincible == 0:
-      if self.incursion:
-        # Check if any Qix are touching an active incursion
-        touching_path = False
-        for enemy in enemies:
-          if touching_path == True:
-            break
-          elif type(enemy) == Sparc:
-            if enemy.hitbox.clipline((self.path[0], self.path[1])) != ():
-              touching_path = True
-              break
-          for i in range(len(self.path)-1):
-            if enemy.hitbox.clipline((self.path[i], self.path[i+1])) != ():
-              touching_path = True
-              break
-
-        if self.is_touching_enemy(enemies) or touching_path:
-          self.x = self.path[0][0]
-          self.y = self.path[0][1]
-          self.incursion = False
-          self.path = []
-          self.lose_life()
-          self.invincible += 1
-      elif self.is_touching_enemy(enemies):
-        self.lose_life()
-        self.invincible += 1
-    elif 0 < self.invincible < 50:
-      self.invincible += 1
-    elif self.invincible == 50:
-      self.invincible = 0
-    self.draw(surface)
-
-  def start_incursion(self):
-    pass
-  
-  def is_touching_enemy(self, enemies):
-    if self.hitbox.collideobjects([enemy.hitbox for enemy in enemies]) == None:
-      return False
-    else: return True
-
-  def is_touching_corner(self, corners):
-    # Should check if the player has reach an intersection
-    pass
-  
-  def lose_life(self):
-    if self.lives > 0:
-      self.lives -= 1
-
-
-class Qix:
-  def __init__(self, x, y):
-    self.x = x
-    self.y = y
-    self.vel_x = 0
-    self.vel_y = 0
-    self.radius = 10
-    self.hitbox = pygame.Rect(x-self.radius, y-self.radius, 2*self.radius, 2*self.radius)
-    self._moving = 0
-
-  def move(self, map_edges):
-    min_x, max_x = map_edges[0][0][0] + 25, map_edges[0][2][0] - 25
-    min_y, max_y = map_edges[0][2][1] + 25, map_edges[0][0][1] - 25
-
-    if self._moving == 0:
-      self._moving = int((random.random() + 1) * 30)
-      direction = random.randint(1, 4)
-      if direction == 1:
-        self.vel_x = 1
-        self.vel_y = 0
-      elif direction == 2:
-        self.vel_x = -1
-        self.vel_y = 0
-      elif direction == 3:
-        self.vel_y = 1
-        self.vel_x = 0
-      else: 
-        self.vel_y = -1
-        self.vel_x = 0
-
-    if self.x < min_x:
-      self.x = min_x
-    elif self.x > max_x:
-      self.x = max_x
-    else:
-      self.x += self.vel_x
-    
-    if self.y < min_y:
-      self.y = min_y
-    elif self.y > max_y:
-      self.y = max_y
-    else:
-      self.y += self.vel_y
-
-    self._moving -= 1
-    self.hitbox = pygame.Rect(self.x-self.radius, self.y-self.radius, 2*self.radius, 2*self.radius)
-
-  def draw(self, surface, player, map):
-    self.move(map.edges)
-    pygame.draw.rect(surface, 'red', self.hitbox, 0)
-
-
-class Sparc:
-  def __init__(self, x, y, starting_segment, init_vel):
-    self.x = x
-    self.y = y
-    self.vel_x = init_vel
-    self.vel_y = init_vel
-    self.radius = 10
-    self.segment = starting_segment
-    self.horizontal = True if starting_segment in [0, 2] else False
-    self.hitbox = pygame.Rect(x-self.radius, y-self.radius, 2*self.radius, 2*self.radius)
-    self._speed = 1
-
-  # Which direction to move (towards player or not)
-  def is_chasing(self, player: Player):
-    range = 100
-    if math.sqrt((self.x - player.x)**2 + (self.y - player.y)**2) <= range:
-      if (player.x - self.x) == 0 and (player.y - self.y) == 0:
-        return (0, 0)
-      elif (player.x - self.x) == 0:
-        return (0, (player.y - self.y) / abs(player.y - self.y))
-      elif (player.y - self.y) == 0:
-        return ((player.x - self.x) / abs(player.x - self.x), 0)
-      else:
-        return ((player.x - self.x) / abs(player.x - self.x), (player.y - self.y) / abs(player.y - self.y))
-    else: return None
+import time
+STARTED = time.perf_counter()  # Before the imports, they are most of the startup time
 
-  def move(self, map_edges, player: Player):
-    current_edge = map_edges[0]
-    min_x, max_x = map_edges[0][0][0], map_edges[0][2][0]
-    min_y, max_y = map_edges[0][2][1], map_edges[0][0][1]
-    direction = self.is_chasing(player)
-
-    if direction != None:
-      self.vel_x = self._speed * direction[0]
-      self.vel_y = self._speed * direction[1]
-
-    if self.segment == 0 or self.segment == 2:  #Bottom or Top (horizontal)
-      self.x += self.vel_x * self._speed
-      if not is_between((self.x, self.y), (current_edge[self.segment], current_edge[(self.segment + 1) % 4])):
-        self.y = max_y if self.segment == 0 else min_y
-      if self.x <= min_x:
-        self.x = min_x
-        handle_corner(self, map_edges)
-      elif self.x >= max_x:
-        self.x = max_x
-        handle_corner(self, map_edges)
-    elif self.segment == 1 or self.segment == 3:  #Left or Right (vertical)
-      self.y += self.vel_y * self._speed
-      if not is_between((self.x, self.y), (current_edge[self.segment], current_edge[(self.segment + 1) % 4])):
-        self.x = min_x if self.segment == 1 else max_x
-      if self.y <= min_y:
-        self.y = min_y
-        handle_corner(self, map_edges)
-      elif self.y >= max_y:
-        self.y = max_y
-        handle_corner(self, map_edges)
-    self.hitbox = pygame.Rect(self.x-self.radius, self.y-self.radius, 2*self.radius, 2*self.radius)
-
-  def draw(self, surface, player, map):
-    self.move(map.edges, player)
-    pygame.draw.rect(surface, 'purple', self.hitbox, 0)
-
-
-# HELPER FUNCTIONS
-
-def is_between(point, segment):
-  # Sorry for the messy logic, the first if statements check if the x coords are all equal (lined up)
-  # and the nested if, checks to see if the y coord of point is between that of the endpoints of segment
-  # Similar thing except the other way around for the elif statement
-  if point[0] == segment[0][0] and point[0] == segment[1][0]: 
-    if point[1] <= max(segment[0][1], segment[1][1]) and point[1] >= min(segment[0][1], segment[1][1]):
-      return True
-    else: return False
-  elif point[1] == segment[0][1] and point[1] == segment[1][1]: 
-    if point[0] <= max(segment[0][0], segment[1][0]) and point[0] >= min(segment[0][0], segment[1][0]):
-      return True
-    else: return False
-  else: return False
-
-
-def handle_corner(player: Player, map_edges):
-  current_edge = map_edges[0]
-  corners = current_edge
-
-  #check which corner we're at and transition
-  if player.x == corners[0][0] and player.y == corners[0][1]:  # (200, 400) - Bottom left or Left bottom
-    if player.segment == 0 and player.vel_x < 0:  # Bottom to Left
-      player.segment = 1
-      player.horizontal = False
-      player.vel_x = 0
-      player.vel_y = -1
-    if player.segment == 1 and player.vel_y > 0:  # Left to Bottom
-      player.segment = 0
-      player.horizontal = True
-      player.vel_x = 1
-      player.vel_y = 0
-  if player.x == corners[3][0] and player.y == corners[3][1]:  # (400, 400) - Bottom right or Right bottom
-      if player.segment == 0 and player.vel_x > 0:  # Bottom to Right
-        player.segment = 3
-        player.horizontal = False
-        player.vel_x = 0
-        player.vel_y = -1
-      if player.segment == 3 and player.vel_y > 0:  # Right to Bottom
-        player.segment = 0
-        player.horizontal = True
-        player.vel_x = -1
-        player.vel_y = 0
-  if player.x == corners[2][0] and player.y == corners[2][1]:  # (400, 200) - Right top or Top right
-      if player.segment == 3 and player.vel_y < 0:  # Right to Top
-        player.segment = 2
-        player.horizontal = True
-        player.vel_x = -1
-        player.vel_y = 0
-      if player.segment == 2 and player.vel_y > 0:  # Top to Right
-        player.segment = 3
-        player.horizontal = False
-        player.vel_x = 0
-        player.vel_y = 1
-  if player.x == corners[1][0] and player.y == corners[1][1]:  # (200, 200) - Top left or Left top
-      if player.segment == 2 and player.vel_x < 0:  # Top to Left
-        player.segment = 1
-        player.horizontal = False
-        player.vel_x = 0
-        player.vel_y = 1
-      if player.segment == 1 and player.vel_y < 0:  # Left to Top
-        player.segment = 2
-        player.horizontal = True
-        player.vel_x = 1
-        player.vel_y = 0
-
-
-def draw_progress_bar(surface, map: Map):
-    total_area = map.size * map.size
-    captured_area = total_area - map.area_remaining
-    progress =  captured_area / total_area
-    
-    # Draw progress bar background
-    bar_width = 200
-    bar_height = 20
-    bar_x = 600 // 2 - bar_width // 2
-    bar_y = 550
-    pygame.draw.rect(surface, "gray", (bar_x, bar_y, bar_width, bar_height))
-
-    # Draw target progress bar
-    pygame.draw.rect(surface, "red", (bar_x+bar_width*map.target, bar_y, 2, bar_height))
-    
-    # Draw progress
-    progress_width = int(bar_width * progress)
-    pygame.draw.rect(surface, "forestgreen", (bar_x, bar_y, progress_width, bar_height))
-    
-    # Draw text
-    progress_text = font.render(f"{int(progress * 100)}%", True, "black")
-    surface.blit(progress_text, (bar_x + bar_width + 10, bar_y))
-
-#---------------------------------------------------------------
-def draw_start_screen(surface):
-  surface.fill("white")
-  title = font.render("Qix Game", True, "black")
-  surface.blit(title, (600 // 2 - title.get_width() // 2, 100))
-  instructions = [
-      font.render("Use Arrow Keys to move", True, "black"),
-      font.render("Press Spacebar to start incursion", True, "black"),
-      font.render("Press Escape to pause the game", True, "black"),
-      font.render("Claim 50% of the field to win", True, "black")
-  ]
-  for i, line in enumerate(instructions):
-      surface.blit(line, (600 // 2 - line.get_width() // 2, 200 + i * 40))
-
-  button_rect = pygame.Rect(250, 400, 100, 50)
-  pygame.draw.rect(surface, "forestgreen", button_rect)
-  button_text = font.render("Start", True, "white")
-  text_rect = button_text.get_rect(center=button_rect.center)
-  surface.blit(button_text, text_rect)
-
-  return button_rect
-
-def draw_end_screen(surface):
-  surface.fill("white")
-  title = font.render("Game Over", True, "black")
-  surface.blit(title, (600 // 2 - title.get_width() // 2, 100))
-
-  button_text = font.render("Play Again", True, "white")
-  button_rect = pygame.Rect(250, 400, button_text.get_width() + 30, 50)
-  pygame.draw.rect(surface, "forestgreen", button_rect)
-  text_rect = button_text.get_rect(center=button_rect.center)
-  surface.blit(button_text, text_rect)
-
-  return button_rect
-
-def draw_win_screen(surface):
-  surface.fill("white")
-  title = font.render("Congratulations, You Won!", True, "black")
-  surface.blit(title, (600 // 2 - title.get_width() // 2, 100))
-
-  button_rect = pygame.Rect(250, 400, 100, 50)
-  pygame.draw.rect(surface, "forestgreen", button_rect)
-  button_text = font.render("Exit", True, "white")
-  text_rect = button_text.get_rect(center=button_rect.center)
-  surface.blit(button_text, text_rect)
-
-  return button_rect
-
-def draw_pause_screen(surface):
-  surface.fill("white")
-  title = font.render("Game Paused", True, "black")
-  surface.blit(title, (600 // 2 - title.get_width() // 2, 100))
-
-  button_rect = pygame.Rect(250, 400, 100, 50)
-  pygame.draw.rect(surface, "forestgreen", button_rect)
-  button_text = font.render("Resume", True, "white")
-  text_rect = button_text.get_rect(center=button_rect.center)
-  surface.blit(button_text, text_rect)
-
-  return button_rect
-
-def draw_lives(surface, player):
-  heart_icon = font.render("♥", True, "red")
-  lives_text = font.render(f" {player.lives}", True, "black")
-  surface.blit(heart_icon, (10, 10))
-  surface.blit(lives_text, (30, 10))
-
-def reset_level(level: int):
-  map = copy.deepcopy(level_maps[level])
-  player = map.init_player
-  enemies = map.enemies
-  return (map, player, enemies)
-
-#--------------------------------------------------------------
+import argparse
+import pygame
 
-# pygame setup
-pygame.init()
-screen = pygame.display.set_mode((600, 600))
+from sim import GameSim, TICK_RATE, SEED_MIN, SEED_MAX
+from controls import Controls
+from render import Renderer, RESOLUTION
+from replay import Recording
+from profiler import frame_profiler
+
+TICK = 1 / TICK_RATE
+# Most simulation steps run before a frame is drawn. When rendering falls further behind than this the game
+# slows down instead of spending ever longer catching up
+MAX_STEPS_PER_FRAME = 5
+# Frame rate of the menu screens, which never change, so they do not spin the CPU redrawing the same frame
+MENU_FPS = 30
+
+def seed(value):
+  value = int(value)
+  if not SEED_MIN <= value <= SEED_MAX:
+    raise argparse.ArgumentTypeError(f"must be between {SEED_MIN} and {SEED_MAX}")
+  return value
+
+parser = argparse.ArgumentParser(description="Play Qix")
+parser.add_argument("--seed", type=seed, help="seed for the enemies, random if not given")
+parser.add_argument("--record", metavar="FILE", help="record the game to FILE so it can be replayed with replay.py")
+parser.add_argument("--fps", type=int, default=0, help="limit the frames drawn per second, 0 for no limit")
+parser.add_argument("--vsync", action="store_true", help="draw frames in sync with the display")
+parser.add_argument("--scale", type=float, default=1,
+                    help="window size as a multiple of the 600x600 frames, which are scaled up once per frame")
+parser.add_argument("--startup-time", action="store_true",
+                    help="print the time taken to show the first frame and quit, bench.py --startup runs this")
+args = parser.parse_args()
+
+# pygame setup, only the modules the game uses (pygame.init() would also start audio and joysticks)
+pygame.display.init()
+pygame.font.init()
+if args.vsync:
+  screen = pygame.display.set_mode(RESOLUTION, pygame.SCALED, vsync=1)
+else:
+  screen = pygame.display.set_mode((round(RESOLUTION[0] * args.scale), round(RESOLUTION[1] * args.scale)))
 clock = pygame.time.Clock()
 running = True
 game_state = "start"
-# player = Player(300, 400, 0, 0, 0)
-# enemies = [Qix(300, 300, 0), Sparc(300, 200, 2)]
-# qix = Qix(300, 300, 0)
-# sparc = Sparc(300, 200, 2)
-level = 0
-level_maps = [Map(200, ((200, 400), (200, 200), (400, 200), (400, 400)), Player(3, 300, 400, 0, 0, 0), [Qix(300, 300), Sparc(300, 200, 2, 1)], 0.5),
-              Map(300, ((150, 450), (150, 150), (450, 150), (450, 450)), Player(3, 300, 450, 0, 0, 0), [Qix(300, 300), Qix(200, 200), Sparc(300, 150, 2, 1)], 0.5),
-              Map(400, ((100, 500), (100, 100), (500, 100), (500, 500)), Player(5, 300, 500, 0, 0, 0), [Qix(300, 300), Qix(200, 200), Sparc(300, 100, 2, -1), Sparc(500, 300, 3, 1)], 0.5)]
-map = copy.deepcopy(level_maps[level])
-player = map.init_player
-enemies = map.enemies
-#map.add_edge(((250, 400), (250, 300), (350, 300), (350, 400)))
-font = pygame.font.SysFont("Arial", 30)
+# The sim is created once the start screen is up, the first level is built while the player reads it
+sim = None
+# pygame's own font file, SysFont("Arial") would scan every font installed first
+font = pygame.font.Font(None, 30)
+renderer = Renderer(screen, font)
+controls = Controls()
+quicksave = None  # Snapshot taken with F5, F9 goes back to it
+# The simulation runs at TICK_RATE whatever the frame rate, accumulator is the time it still has to catch up on
+accumulator = 0.0
+last_time = time.perf_counter()
 
 while running:
+  frame_profiler.begin_frame()
 
-  if player.lives <= 0:
+  if game_state == "playing" and sim.state == "over":
     game_state = "over"
-  
-  if map.size**2 - map.area_remaining >= map.size**2 * map.target:
-    if level == 2:
-      game_state = "win"
-    else:
-      level += 1
-      map, player, enemies = reset_level(level)
+  elif game_state == "playing" and sim.state == "win":
+    game_state = "win"
 
   # poll for events
   # pygame.QUIT event means the user clicked X to close your window
+  now = time.perf_counter()
+  elapsed, last_time = now - last_time, now
   for event in pygame.event.get():
     if event.type == pygame.QUIT:
       running = False
     elif event.type == pygame.MOUSEBUTTONDOWN:
+      position = renderer.to_field(event.pos)  # Buttons are on the field surface
       if game_state == "start":
-        if start_button.collidepoint(event.pos):
+        if start_button.collidepoint(position):
           game_state = "playing"
+          accumulator = 0.0
       elif game_state == "over":
-        if play_again_button.collidepoint(event.pos):
-          map, player, enemies = reset_level(level)
+        if play_again_button.collidepoint(position):
+          sim.reset_level(sim.level)
+          controls.reset()
           game_state = "playing"
+          accumulator = 0.0
       elif game_state == "win":
-        if end_button.collidepoint(event.pos):
+        if end_button.collidepoint(position):
           running = False
       elif game_state == "paused":
-        if pause_button.collidepoint(event.pos):
+        if pause_button.collidepoint(position):
           game_state = "playing"
+          accumulator = 0.0
+    elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+      frame_profiler.toggle()
+    elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+      # The frame timings are only there while the F3 profiler is on, the latency log always is
+      if frame_profiler.frames:
+        frame_profiler.export_csv(time.strftime("profile-%Y%m%d-%H%M%S.csv"))
+      if controls.latency.count:
+        controls.latency.export_csv(time.strftime("latency-%Y%m%d-%H%M%S.csv"))
     elif event.type == pygame.KEYDOWN and game_state == "playing": # if a key is pressed
       if event.key == pygame.K_ESCAPE:
         game_state = "paused"
-      if player.incursion:
-        if event.key == pygame.K_LEFT:
-          player.vel_x = -1
-        elif event.key == pygame.K_RIGHT:
-          player.vel_x = 1
-        elif event.key == pygame.K_UP:
-          player.vel_y = -1
-        elif event.key == pygame.K_DOWN:
-          player.vel_y = 1
-      else:
-        if event.key == pygame.K_LEFT:
-          player.vel_x = -1
-        elif event.key == pygame.K_RIGHT:
-          player.vel_x = 1
-        elif event.key == pygame.K_UP:
-          player.vel_y = -1
-        elif event.key == pygame.K_DOWN:
-          player.vel_y = 1
-      if event.key == pygame.K_SPACE and not player.incursion:
-        player.incursion = True
-        player.path = [(player.x, player.y)]  # Start path at current position
-      #test case for when player gets hit (press l)
-      # elif event.type == pygame.KEYDOWN and game_state == "playing" and event.key == pygame.K_l:
-      #   player.lose_life()
-    elif event.type == pygame.KEYUP and game_state == "playing": 
-      player.vel_x = 0
-      player.vel_y = 0
-    
+      elif event.key == pygame.K_F5:
+        quicksave = sim.snapshot()
+      elif event.key == pygame.K_F9 and quicksave is not None:
+        sim.restore(quicksave)
+        controls.reset()
+      controls.handle_event(event)
+    elif event.type == pygame.KEYUP:
+      controls.handle_event(event)
+  frame_profiler.lap("events")
 
   #----------------------------------------------------------
-  # RENDER YOUR GAME HERE
+  # UPDATE AND RENDER YOUR GAME HERE
+  dirty_rects = None
   if game_state == "start":
-    start_button = draw_start_screen(screen)
+    start_button = renderer.draw_start_screen()
   elif game_state == "playing":
-    screen.fill("white")
-    map.draw(screen)
-    player.update(screen, map, enemies)
-    # print(player.is_touching_enemy(enemies))
-    for enemy in enemies:
-      enemy.draw(screen, player, map)
-    draw_lives(screen, player)
-    draw_progress_bar(screen, map)
-    # Just to test progression
-    # map.area_remaining -= 50
+    accumulator += elapsed
+    steps = 0
+    while accumulator >= TICK and steps < MAX_STEPS_PER_FRAME and sim.state == "playing":
+      sim.step(controls.poll())  # Keys are read once per step
+      accumulator -= TICK
+      steps += 1
+    if steps == MAX_STEPS_PER_FRAME:
+      accumulator %= TICK  # Too far behind, drop the time that could not be simulated
+    dirty_rects = renderer.draw_game(sim, min(accumulator / TICK, 1.0))
   elif game_state == "over":
-    play_again_button = draw_end_screen(screen)
+    play_again_button = renderer.draw_end_screen()
   elif game_state == "win":
-    end_button = draw_win_screen(screen)
+    end_button = renderer.draw_win_screen()
   elif game_state == "paused":
-    pause_button = draw_pause_screen(screen)
-
-#------------------------------------------------------------
-  # pygame.draw.circle(screen, "red", (100, 100), 40)
-
-  # flip() the display to put your work on screen
-  pygame.display.flip()
-  clock.tick(60)  # limits FPS to 60
-
-pygame.quit()
\ No newline at end of file
+    pause_button = renderer.draw_pause_screen()
+
+  # flip() the display to put your work on screen, or only update what changed while playing
+  if dirty_rects is None:
+    pygame.display.flip()
+  else:
+    pygame.display.update(dirty_rects)
+  controls.latency.presented()
+  frame_profiler.lap("display.update")
+  if sim is None:  # The first frame is on screen
+    if args.startup_time:
+      print(f"first frame after {(time.perf_counter() - STARTED) * 1000:.1f} ms", flush=True)
+      break
+    sim = GameSim(seed=args.seed, record=args.record is not None, preload=True, interpolate=True)
+  frame_profiler.end_frame()
+  # limits FPS to args.fps while playing, or not at all if it is 0
+  clock.tick(args.fps if game_state == "playing" else MENU_FPS)
+
+latency = controls.latency.stats()
+if latency is not None:
+  print(f"input latency over {min(controls.latency.count, controls.latency.size)} presses: "
+        f"average {latency[0]:.1f} ms, p50 {latency[1]:.1f} ms, p99 {latency[2]:.1f} ms")
+if args.record and sim is not None:
+  Recording.from_sim(sim).save(args.record)
+pygame.quit()
@@ -0,0 +1,350 @@
+import numpy as np
+import pygame
+
+from game import Qix, Sparc, QIX_CLEARANCE, QIX_DIRECTIONS, place_on_boundary
+
+QIX = 0
+SPARC = 1
+COLOURS = (Qix.colour, Sparc.colour)
+
+DIRECTIONS = np.array(QIX_DIRECTIONS, dtype=float)
+
+class EnemyList:
+  """
+  Backend that moves one Qix or Sparc object at a time, with the same interface as EnemyPool so the
+  player, sim and renderer never check which backend they have. Used for levels with few enemies
+  enemies: the Qix and Sparc objects, in level order
+  kind: QIX or SPARC for every enemy
+  radius: radius of every enemy
+  """
+  def __init__(self, enemies):
+    self.enemies = enemies
+    self.kind = np.array([SPARC if type(enemy) == Sparc else QIX for enemy in enemies], dtype=np.int8)
+    self.radius = np.array([enemy.radius for enemy in enemies], dtype=float)
+
+  def __len__(self):
+    return len(self.enemies)
+
+  def __iter__(self):
+    return iter(self.enemies)
+
+  def update(self, map, player):
+    for enemy in self.enemies:
+      enemy.update(map, player)
+
+  def qix_positions(self):
+    return [(enemy.x, enemy.y) for enemy in self.enemies if type(enemy) == Qix]
+
+  def positions(self):
+    """
+    (n, 2) float array of the enemy positions, a new array the caller may keep
+    """
+    return np.array([(enemy.x, enemy.y) for enemy in self.enemies], dtype=float).reshape(-1, 2)
+
+  def collide_rect(self, rect):
+    for enemy in self.enemies:
+      if rect.colliderect(enemy.hitbox):
+        return True
+    return False
+
+  def collide_trail(self, grid):
+    """
+    True if any enemy touches a segment of the trail indexed by grid (a SegmentGrid).
+    Only the trail segments that share a grid cell with an enemy get the exact clipline test
+    """
+    if grid.bounds is None:
+      return False
+    for enemy in self.enemies:
+      if not grid.bounds.colliderect(enemy.hitbox):
+        continue
+      for i in grid.query(enemy.hitbox):
+        if enemy.hitbox.clipline(grid.segments[i]) != ():
+          return True
+    return False
+
+  def topleft(self, positions=None, scale=1.0, offset=(0, 0)):
+    """
+    List of the top left corner of every enemy, where its sprite is drawn (see EnemyPool.topleft)
+    """
+    if scale == 1 and offset == (0, 0) and positions is None:
+      return [enemy.hitbox.topleft for enemy in self.enemies]
+    positions = self.positions() if positions is None else positions
+    radius = np.maximum(np.rint(self.radius * scale), 1)
+    return (positions * scale + offset - radius[:, None]).tolist()
+
+
+class EnemyPool:
+  """
+  Struct-of-arrays backend that moves every Qix and Sparc in one batched NumPy step instead of one
+  Python object per enemy. Behaves like Qix.move and Sparc.move, for levels with hundreds of enemies
+  kind: QIX or SPARC for every enemy
+  pos: (n, 2) float array of enemy positions
+  vel: (n, 2) float array of enemy velocities
+  radius: radius of every enemy
+  timer: frames left before each Qix picks a new direction (Qix._moving)
+  horizontal: True for each Sparc that starts on a horizontal side (Sparc.horizontal)
+  arc: position of each Sparc along the boundary (Sparc.arc)
+  direction: 1 or -1, direction of each Sparc along the boundary (Sparc.direction)
+  boundary: Boundary the Sparx were placed on
+  lengths, corners, tangents: arrays of boundary.lengths, points and tangents, to convert arcs to positions
+  speed: speed of each Sparc (Sparc._speed)
+  hitboxes: (n, 4) int array of (left, top, width, height) for every enemy, updated in place every step
+  far: (n, 2) int array of the right and bottom of every hitbox, updated with it
+  rng: random generator used for the Qix random walk
+  """
+  def __init__(self, enemies, seed=None):
+    self.kind = np.array([SPARC if type(enemy) == Sparc else QIX for enemy in enemies], dtype=np.int8)
+    self.pos = np.array([(enemy.x, enemy.y) for enemy in enemies], dtype=float).reshape(-1, 2)
+    self.vel = np.array([(enemy.vel_x, enemy.vel_y) for enemy in enemies], dtype=float).reshape(-1, 2)
+    self.radius = np.array([enemy.radius for enemy in enemies], dtype=float)
+    self.timer = np.array([getattr(enemy, "_moving", 0) for enemy in enemies], dtype=np.int32)
+    self.horizontal = np.array([getattr(enemy, "horizontal", False) for enemy in enemies], dtype=bool)
+    self.arc = np.zeros(len(enemies), dtype=float)
+    self.direction = np.ones(len(enemies), dtype=float)
+    self.boundary = None
+    self.lengths = self.corners = self.tangents = None
+    self.speed = np.array([getattr(enemy, "_speed", 0) for enemy in enemies], dtype=float)
+    self.rng = np.random.default_rng(seed)
+    self.build_buffers()
+
+  def build_buffers(self):
+    """
+    Index the Qix and Sparx and set up the hitboxes and the scratch buffers of the steps and collision tests,
+    which are reused every step. Called again whenever the enemy arrays are replaced (snapshot.restore_snapshot)
+    """
+    count = len(self.kind)
+    self.qix = np.flatnonzero(self.kind == QIX)
+    self.sparc = np.flatnonzero(self.kind == SPARC)
+    # Levels list each kind of enemy together, so a kind can usually be selected with a slice,
+    # which gives views of the arrays instead of the copies an index array gives
+    self._qix_rows = _rows(self.qix)
+    self._sparc_rows = _rows(self.sparc)
+    self.hitboxes = np.zeros((count, 4), dtype=np.int32)
+    self.hitboxes[:, 2] = 2 * self.radius
+    self.hitboxes[:, 3] = 2 * self.radius
+    self.far = np.zeros((count, 2), dtype=np.int32)
+    # Views and buffers are made once here, slicing or broadcasting every step would allocate new arrays.
+    # They are all contiguous, NumPy needs temporary buffers for strided or broadcast operands
+    self._hitbox_corner = self.hitboxes[:, :2]
+    self._offset = np.repeat(self.radius[:, None], 2, axis=1)
+    self._size = np.ascontiguousarray(self.hitboxes[:, 2:])
+    self._position = np.zeros((count, 2), dtype=float)
+    self._corner = np.zeros((count, 2), dtype=np.int32)
+    self._columns = (self._corner[:, 0], self._corner[:, 1], self.far[:, 0], self.far[:, 1])
+    self._mask = np.zeros(count, dtype=bool)
+    self._scratch = np.zeros(count, dtype=bool)
+    # Scratch buffers of the Qix and Sparc steps, one entry per Qix or Sparc
+    qix, sparc = len(self.qix), len(self.sparc)
+    self._here = np.zeros(qix, dtype=np.uint8)
+    self._ahead = np.zeros(qix, dtype=np.uint8)
+    self._step = np.zeros((qix, 2), dtype=float)
+    self._coordinate = np.zeros(qix, dtype=float)
+    self._cells = np.zeros(qix, dtype=np.intp)
+    self._columns_at = np.zeros(qix, dtype=np.intp)
+    self._outside = np.zeros((2, qix), dtype=bool)
+    self._room = np.zeros((len(DIRECTIONS), qix), dtype=np.uint8)
+    self._most = np.zeros(qix, dtype=np.uint8)
+    self._best = np.zeros(qix, dtype=np.intp)
+    self._qix_masks = np.zeros((3, qix), dtype=bool)
+    self._along = np.zeros((3, sparc), dtype=float)
+    self._sparc_masks = np.zeros((2, sparc), dtype=bool)
+    self._corners_at = np.zeros((sparc, 2), dtype=float)
+    self._tangents_at = np.zeros((sparc, 2), dtype=float)
+    self.update_hitboxes()
+
+  def __len__(self):
+    return len(self.kind)
+
+  def update(self, map, player):
+    self.move_qix(map)
+    self.move_sparc(map, player)
+    self.update_hitboxes()
+
+  def move_qix(self, map):
+    if len(self.qix) == 0:
+      return
+    i = self._qix_rows
+    pos, vel, timer = self.pos[i], self.vel[i], self.timer[i]
+    new_direction, blocked, scratch = self._qix_masks
+
+    np.equal(timer, 0, out=new_direction)
+    count = np.count_nonzero(new_direction)
+    if count:
+      # Only a few Qix pick a new direction each frame, setting them one by one avoids mask indexing
+      timers = ((self.rng.random(count) + 1) * 30).astype(np.int32).tolist()
+      directions = self.rng.integers(0, 4, count).tolist()
+      for row, frames, direction in zip(np.flatnonzero(new_direction).tolist(), timers, directions):
+        timer[row] = frames
+        vel[row] = QIX_DIRECTIONS[direction]
+
+    # Stay QIX_CLEARANCE away from captured territory, unless the move leads further from it
+    here = self.distances_at(map, pos, self._here)
+    ahead = self.distances_at(map, np.add(pos, vel, out=self._step), self._ahead)
+    np.less(ahead, QIX_CLEARANCE, out=blocked)
+    blocked &= np.less_equal(ahead, here, out=scratch)
+    if np.count_nonzero(blocked):
+      # Bounce towards the most open direction (the first one on ties) and pick a new random direction next frame
+      room = self._room
+      for k, direction in enumerate(DIRECTIONS):
+        self.distances_at(map, np.add(pos, direction, out=self._step), room[k])
+      best = np.argmax(room, axis=0, out=self._best)
+      np.copyto(vel, np.take(DIRECTIONS, best, axis=0, out=self._step, mode="clip"), where=blocked[:, None])
+      np.copyto(ahead, np.max(room, axis=0, out=self._most), where=blocked)
+      np.copyto(timer, 1, where=blocked)
+    moving = np.greater_equal(ahead, QIX_CLEARANCE, out=new_direction)
+    moving |= np.greater(ahead, here, out=scratch)
+    np.copyto(pos, np.add(pos, vel, out=self._step), where=moving[:, None])
+    timer -= 1
+    if type(i) != slice:
+      self.pos[i], self.vel[i], self.timer[i] = pos, vel, timer
+
+  def move_sparc(self, map, player):
+    if len(self.sparc) == 0:
+      return
+    i = self._sparc_rows
+    boundary = map.boundary
+    if self.boundary is not boundary:
+      self.place_sparc(boundary)
+    perimeter = boundary.perimeter
+    arc, direction = self.arc[i], self.direction[i]
+    ahead, behind, along = self._along
+    chasing, forward = self._sparc_masks
+
+    # Chase the player along the boundary when in range, the shortest way round
+    if player.arc is not None:
+      np.remainder(np.subtract(player.arc, arc, out=ahead), perimeter, out=ahead)
+      np.subtract(perimeter, ahead, out=behind)
+      np.less_equal(np.minimum(ahead, behind, out=along), 100, out=chasing)
+      chasing &= np.not_equal(ahead, 0, out=forward)
+      # 1 going forward is shorter (or as short), -1 otherwise
+      np.copyto(along, np.less_equal(ahead, behind, out=forward))
+      along *= 2
+      along -= 1
+      np.copyto(direction, along, where=chasing)
+
+    np.multiply(direction, self.speed[i], out=along)
+    np.remainder(np.add(arc, along, out=along), perimeter, out=arc)
+    index = np.searchsorted(self.lengths, arc, side="right")
+    index -= 1
+    # Position is the corner the edge starts at plus the distance along it in the direction of the edge
+    np.subtract(arc, np.take(self.lengths, index, out=along, mode="clip"), out=along)
+    offset, corner = self._tangents_at, self._corners_at
+    np.copyto(corner, along[:, None])
+    np.multiply(np.take(self.tangents, index, axis=0, out=offset, mode="clip"), corner, out=offset)
+    np.add(np.take(self.corners, index, axis=0, out=corner, mode="clip"), offset, out=corner)
+    self.pos[i] = corner
+    if type(i) != slice:
+      self.arc[i], self.direction[i] = arc, direction
+
+  def place_sparc(self, boundary):
+    """
+    Put every Sparc on boundary, at the start of the level or after a capture replaced the old one
+    """
+    i = self.sparc
+    if self.boundary is not None:
+      # Keep going the same way on screen as on the old boundary
+      index = np.searchsorted(self.lengths, self.arc[i], side="right") - 1
+      self.vel[i] = self.tangents[index] * self.direction[i, None]
+    for k in i.tolist():
+      self.arc[k], self.direction[k] = place_on_boundary(boundary, *self.pos[k].tolist(), *self.vel[k].tolist(),
+                                                         self.horizontal[k])
+    self.use_boundary(boundary)
+
+  def use_boundary(self, boundary):
+    """
+    Take boundary as the one the Sparx are on, without moving them
+    """
+    self.boundary = boundary
+    self.lengths = np.array(boundary.lengths, dtype=float)
+    self.corners = np.array(boundary.points, dtype=float)
+    self.tangents = np.array(boundary.tangents, dtype=float)
+
+  def distances_at(self, map, points, out):
+    """
+    Map.distance_at for the (Qix count, 2) array points, written to the uint8 buffer out and read through
+    map.distance_grid without allocating any array
+    """
+    coordinate, cells, columns = self._coordinate, self._cells, self._columns_at
+    outside, scratch = self._outside
+    np.floor(np.subtract(points[:, 1], map.origin[1], out=coordinate), out=coordinate)
+    np.less(coordinate, 0, out=outside)
+    outside |= np.greater_equal(coordinate, map.size, out=scratch)
+    np.copyto(cells, coordinate, casting="unsafe")
+    cells *= map.size
+    np.floor(np.subtract(points[:, 0], map.origin[0], out=coordinate), out=coordinate)
+    outside |= np.less(coordinate, 0, out=scratch)
+    outside |= np.greater_equal(coordinate, map.size, out=scratch)
+    np.copyto(columns, coordinate, casting="unsafe")
+    cells += columns
+    np.take(map.distance_grid.reshape(-1), cells, out=out, mode="clip")
+    np.copyto(out, 0, where=outside)
+    return out
+
+  def qix_positions(self):
+    return [tuple(position) for position in self.pos[self.qix].tolist()]
+
+  def positions(self):
+    """
+    (n, 2) float array of the enemy positions, a new array the caller may keep
+    """
+    return self.pos.copy()
+
+  def update_hitboxes(self):
+    # Sizes never change, only the corners move
+    np.subtract(self.pos, self._offset, out=self._position)
+    np.copyto(self._corner, self._position, casting="unsafe")
+    np.add(self._corner, self._size, out=self.far)
+    np.copyto(self._hitbox_corner, self._corner)
+
+  def overlapping(self, rect):
+    """
+    Boolean mask of the enemies whose hitbox overlaps rect, same rules as Rect.colliderect.
+    The mask is a buffer reused by the next call
+    """
+    left, top, right, bottom = self._columns
+    mask, scratch = self._mask, self._scratch
+    np.less(left, rect.right, out=mask)
+    mask &= np.greater(right, rect.left, out=scratch)
+    mask &= np.less(top, rect.bottom, out=scratch)
+    mask &= np.greater(bottom, rect.top, out=scratch)
+    return mask
+
+  def collide_rect(self, rect):
+    return np.count_nonzero(self.overlapping(rect)) > 0
+
+  def collide_trail(self, grid):
+    """
+    True if any enemy touches a segment of the trail indexed by grid (a SegmentGrid)
+    """
+    if grid.bounds is None:
+      return False
+    for index in np.flatnonzero(self.overlapping(grid.bounds)):
+      hitbox = pygame.Rect(self.hitboxes[index].tolist())
+      for segment in grid.query(hitbox):
+        if hitbox.clipline(grid.segments[segment]) != ():
+          return True
+    return False
+
+  def topleft(self, positions=None, scale=1.0, offset=(0, 0)):
+    """
+    List of the top left corner of every enemy, where its sprite is drawn
+    positions: (n, 2) array of where to draw the enemies instead of pos, for rendering between two simulation steps
+    scale, offset: the enemies are drawn at offset + position * scale with sprites of radius * scale (at least 1)
+    """
+    if scale == 1 and offset == (0, 0):
+      if positions is None:
+        return self.hitboxes[:, :2].tolist()
+      return (positions - self.radius[:, None]).tolist()
+    positions = self.pos if positions is None else positions
+    radius = np.maximum(np.rint(self.radius * scale), 1)
+    return (positions * scale + offset - radius[:, None]).tolist()
+
+
+def _rows(indices):
+  """
+  Slice selecting the same rows as the index array indices if they are consecutive, otherwise indices itself
+  """
+  if len(indices) and indices[-1] - indices[0] == len(indices) - 1:
+    return slice(int(indices[0]), int(indices[-1]) + 1)
+  return indices
+
@@ -0,0 +1,79 @@
+import time
+from array import array
+
+
+class FrameProfiler:
+  """
+  Times each phase of a frame into fixed-size ring buffers. Every call returns straight away
+  while the profiler is disabled, so the instrumentation can stay in the main loop
+  enabled: True while timings are being recorded
+  size: number of frames kept per phase
+  samples: phase name -> ring buffer of the time spent in that phase (seconds) over the last size frames
+  frames: number of frames recorded so far
+  """
+  def __init__(self, size=300):
+    self.enabled = False
+    self.size = size
+    self.samples = {}
+    self.frames = 0
+    self._last = 0.0
+    self._slot = 0
+
+  def toggle(self):
+    self.enabled = not self.enabled
+    self.samples.clear()
+    self.frames = 0
+
+  def begin_frame(self):
+    if not self.enabled:
+      return
+    self._slot = self.frames % self.size
+    for buffer in self.samples.values():
+      buffer[self._slot] = 0.0
+    self._last = time.perf_counter()
+
+  def lap(self, phase):
+    """
+    Add the time since the last lap (or the start of the frame) to phase
+    """
+    if not self.enabled:
+      return
+    now = time.perf_counter()
+    buffer = self.samples.get(phase)
+    if buffer is None:
+      buffer = self.samples[phase] = array("d", bytes(8 * self.size))
+    buffer[self._slot] += now - self._last
+    self._last = now
+
+  def end_frame(self):
+    if self.enabled:
+      self.frames += 1
+
+  def stats(self):
+    """
+    List of (phase, average ms, p99 ms) over the frames in the ring buffers
+    """
+    count = min(self.frames, self.size)
+    if count == 0:
+      return []
+    stats = []
+    for phase, buffer in self.samples.items():
+      timings = sorted(buffer[:count])
+      stats.append((phase, sum(timings) / count * 1000, timings[min(int(count * 0.99), count - 1)] * 1000))
+    return stats
+
+  def export_csv(self, path):
+    """
+    Write the recorded frames, oldest first, as one row per frame and one column per phase (ms)
+    """
+    count = min(self.frames, self.size)
+    phases = list(self.samples)
+    with open(path, "w") as file:
+      file.write(",".join(["frame"] + phases) + "\n")
+      for frame in range(self.frames - count, self.frames):
+        slot = frame % self.size
+        file.write(",".join([str(frame)] + [f"{self.samples[phase][slot] * 1000:.4f}" for phase in phases]) + "\n")
+
+
+# Shared by the main loop, GameSim and Renderer
+frame_profiler = FrameProfiler()
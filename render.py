@@ -0,0 +1,391 @@
+import math
+import pygame
+from collections import OrderedDict
+
+import numpy as np
+
+from game import Map, TILE_SIZE
+from pool import COLOURS
+from profiler import frame_profiler
+
+# Frames between refreshes of the profiler overlay text
+OVERLAY_REFRESH = 15
+# Size of the surface every frame is drawn on, whatever the size of the map or the window
+RESOLUTION = (600, 600)
+# Room left for the HUD along the sides of the field surface
+HUD_MARGIN = 50
+
+
+class TextCache:
+  """
+  Cache of rendered text surfaces keyed by (text, colour), so text that does not change
+  is only rasterised once. The least recently used surface is evicted once max_size is reached
+  """
+  def __init__(self, font, max_size=64):
+    self.font = font
+    self.max_size = max_size
+    self.surfaces = OrderedDict()
+
+  def render(self, text, colour):
+    key = (text, colour)
+    surface = self.surfaces.get(key)
+    if surface is None:
+      surface = self.font.render(text, True, colour)
+      self.surfaces[key] = surface
+      if len(self.surfaces) > self.max_size:
+        self.surfaces.popitem(last=False)
+    else:
+      self.surfaces.move_to_end(key)
+    return surface
+
+
+class View:
+  """
+  Where the playfield of a map goes on a surface, the logical point (x, y) is drawn at offset + (x, y) * scale.
+  Maps that fit on the surface inside the HUD margins are drawn at their own coordinates (the built-in levels),
+  bigger ones are scaled down and centred, so maps can be thousands of units across
+  scale: pixels per logical unit
+  offset: pixel position of the logical point (0, 0)
+  identity: True if logical coordinates are pixels
+  """
+  def __init__(self, map: Map, size):
+    left, top = map.origin
+    width, height = size
+    if left + map.size <= width - HUD_MARGIN and top + map.size <= height - HUD_MARGIN:
+      self.scale = 1.0
+      self.offset = (0, 0)
+    else:
+      self.scale = (min(width, height) - 2 * HUD_MARGIN) / map.size
+      self.offset = ((width - map.size * self.scale) / 2 - left * self.scale,
+                     (height - map.size * self.scale) / 2 - top * self.scale)
+    self.identity = self.scale == 1 and self.offset == (0, 0)
+
+  def point(self, x, y):
+    return (self.offset[0] + x * self.scale, self.offset[1] + y * self.scale)
+
+  def points(self, points):
+    if self.identity:
+      return points
+    return [self.point(x, y) for x, y in points]
+
+  def length(self, length):
+    """
+    length logical units in whole pixels, at least 1
+    """
+    return max(round(length * self.scale), 1)
+
+  def cells(self, map: Map, top, left, bottom, right):
+    """
+    Rect of the pixels over the cells in rows top:bottom and columns left:right of map, with a pixel more
+    on every side for the outlines around them
+    """
+    x1, y1 = self.point(map.origin[0] + left, map.origin[1] + top)
+    x2, y2 = self.point(map.origin[0] + right, map.origin[1] + bottom)
+    x1, y1 = math.floor(x1) - 1, math.floor(y1) - 1
+    return pygame.Rect(x1, y1, math.ceil(x2) + 1 - x1, math.ceil(y2) + 1 - y1)
+
+
+class Renderer:
+  """
+  Draws the state of a GameSim onto a surface. The renderer never moves anything,
+  it only reads the map, player and enemies the simulation has already advanced.
+  Frames are drawn on a RESOLUTION field surface, which is scaled onto surface once per frame if it is another size
+  surface: surface the frames end up on (usually the display surface)
+  field: surface every frame is drawn on, surface itself if it is RESOLUTION
+  view: View of the map being drawn on field
+  font: font used for the HUD and the menu screens
+  background: cached drawing of the map (captured territory and outlines), only the tiles of the map
+  (Map.tile_versions) that changed since it was drawn are redrawn
+  dirty_rects: rects drawn over last frame, restored from the background before the next frame is drawn
+  full_redraw: True if the whole surface has to be redrawn next frame (e.g. after a menu screen)
+  text: cache of the HUD text surfaces
+  screens: menu screens that have been drawn once, name -> (surface, button rect)
+  overlay_lines: text of the profiler overlay, refreshed every OVERLAY_REFRESH frames
+  sprites: colour -> pre-rendered image of an entity (player circle or enemy square) in that colour
+  pool_sprites: (enemies, sprite of every enemy in them), enemies never change kind so this is kept for the level
+  """
+  def __init__(self, surface, font):
+    self.surface = surface
+    self.field = surface if surface.get_size() == RESOLUTION else pygame.Surface(RESOLUTION)
+    self.view = None
+    self.font = font
+    self.text = TextCache(font)
+    self.screens = {}
+    self.overlay_text = None
+    self.overlay_lines = []
+    self.background = pygame.Surface(RESOLUTION)
+    self.background_map = None
+    self.background_version = -1
+    self.dirty_rects = []
+    self.full_redraw = True
+    self.sprites = {}
+    self.pool_sprites = (None, [])
+
+  def build_background(self, map: Map):
+    self.view = View(map, RESOLUTION)
+    self.background.fill("white")
+    map.draw(self.background, self.view, self.view.cells(map, 0, 0, map.size, map.size))
+    self.background_map = map
+    self.background_version = map.version
+
+  def update_background(self, map: Map):
+    """
+    Redraw the tiles of the background that changed since it was drawn, returns the rects redrawn.
+    Each row of tiles is redrawn in one go, from its first changed tile to its last
+    """
+    rects = []
+    changed = map.tile_versions > self.background_version
+    for row in np.flatnonzero(changed.any(axis=1)).tolist():
+      columns = np.flatnonzero(changed[row])
+      rect = self.view.cells(map, row * TILE_SIZE, int(columns[0]) * TILE_SIZE, (row + 1) * TILE_SIZE,
+                             (int(columns[-1]) + 1) * TILE_SIZE).clip(self.background.get_rect())
+      map.draw(self.background, self.view, rect)
+      rects.append(rect)
+    self.background_version = map.version
+    return rects
+
+  def to_field(self, position):
+    """
+    Position on the field surface of position on surface, for mouse clicks
+    """
+    if self.field is self.surface:
+      return position
+    return (position[0] * RESOLUTION[0] // self.surface.get_width(),
+            position[1] * RESOLUTION[1] // self.surface.get_height())
+
+  def present(self):
+    """
+    Scale the frame drawn on field onto surface, once per frame
+    """
+    if self.field is not self.surface:
+      pygame.transform.scale(self.field, self.surface.get_size(), self.surface)
+
+  def draw_game(self, sim, alpha=None):
+    """
+    Draw one frame of the game. Returns the list of rects that changed since the last frame,
+    to be passed to pygame.display.update(), or None if the whole surface changed.
+    alpha: how far (0 to 1) the frame is between the last simulation step and the next one, to draw the player
+    and enemies between their positions (sim.positions()) when the sim keeps them, None to draw them where they are
+    """
+    surface = self.field
+    restore = self.dirty_rects
+    if self.background_map is not sim.map:
+      self.build_background(sim.map)
+      self.full_redraw = True
+    elif self.background_version != sim.map.version:
+      restore = restore + self.update_background(sim.map)
+
+    if self.full_redraw:
+      surface.blit(self.background, (0, 0))
+    else:
+      for rect in restore:
+        surface.blit(self.background, rect, rect)
+    frame_profiler.lap("map.draw")
+
+    view = self.view
+    player, enemies = sim.player, sim.enemies
+    player_position, enemy_positions = (player.x, player.y), None
+    if alpha is not None and sim.interpolate:
+      player_position, enemy_positions = sim.positions(alpha)
+    rects = []
+    trail = player.draw_trail(surface, view, player_position)
+    if trail is not None:
+      rects.append(trail)
+    frame_profiler.lap("player.draw")
+
+    # Every entity is a pre-rendered sprite, drawn in one batched blit
+    r = view.length(player.radius)
+    x, y = view.point(*player_position)
+    blits = [(self.sprite(player.colour, r, True), (x - r, y - r))]
+    if len(enemies):
+      if self.pool_sprites[0] is not enemies:
+        sprites = [self.sprite(colour, view.length(enemies.radius[0])) for colour in COLOURS]
+        self.pool_sprites = (enemies, [sprites[kind] for kind in enemies.kind.tolist()])
+      blits.extend(zip(self.pool_sprites[1], enemies.topleft(enemy_positions, view.scale, view.offset)))
+    rects.extend(surface.blits(blits))
+    frame_profiler.lap("enemies.draw")
+    rects.append(self.draw_lives(sim.player))
+    rects.append(self.draw_progress_bar(sim.map))
+    frame_profiler.lap("hud")
+    if frame_profiler.enabled:
+      rects.append(self.draw_profiler_overlay())
+
+    changed = None if self.full_redraw else restore + rects
+    self.dirty_rects = rects
+    self.full_redraw = False
+    if self.field is not self.surface:
+      self.present()
+      return None
+    return changed
+
+  def sprite(self, colour, radius, round=False):
+    """
+    Image of an entity, a filled square of side 2 * radius or a circle of that radius if round,
+    rendered the first time it is needed and converted to the display format
+    """
+    key = (colour, radius, round)
+    image = self.sprites.get(key)
+    if image is None:
+      image = pygame.Surface((2 * radius, 2 * radius), pygame.SRCALPHA if round else 0)
+      if round:
+        pygame.draw.circle(image, colour, (radius, radius), radius)
+      else:
+        image.fill(colour)
+      if pygame.display.get_surface() is not None:
+        image = image.convert_alpha() if round else image.convert()
+      self.sprites[key] = image
+    return image
+
+  def heart(self, colour, size):
+    """
+    Heart icon of width size, drawn rather than rendered from text since the default font has no heart glyph
+    """
+    key = ("heart", colour, size)
+    image = self.sprites.get(key)
+    if image is None:
+      image = pygame.Surface((size, size), pygame.SRCALPHA)
+      r = size // 4
+      pygame.draw.circle(image, colour, (r, r), r)
+      pygame.draw.circle(image, colour, (size - r, r), r)
+      pygame.draw.polygon(image, colour, [(0, r + 1), (size // 2, size - 1), (size, r + 1), (size // 2, r)])
+      if pygame.display.get_surface() is not None:
+        image = image.convert_alpha()
+      self.sprites[key] = image
+    return image
+
+  def draw_progress_bar(self, map: Map):
+    surface = self.field
+    progress = map.captured_area / (map.size * map.size)
+
+    # Draw progress bar background, centred in the bottom margin
+    bar_width = 200
+    bar_height = 20
+    bar_x = surface.get_width() // 2 - bar_width // 2
+    bar_y = surface.get_height() - HUD_MARGIN
+    rect = pygame.draw.rect(surface, "gray", (bar_x, bar_y, bar_width, bar_height))
+
+    # Draw target progress bar
+    pygame.draw.rect(surface, "red", (bar_x+bar_width*map.target, bar_y, 2, bar_height))
+
+    # Draw progress
+    progress_width = int(bar_width * progress)
+    pygame.draw.rect(surface, "forestgreen", (bar_x, bar_y, progress_width, bar_height))
+
+    # Draw text
+    progress_text = self.text.render(f"{int(progress * 100)}%", "black")
+    return rect.union(surface.blit(progress_text, (bar_x + bar_width + 10, bar_y)))
+
+  def draw_profiler_overlay(self):
+    if self.overlay_text is None:
+      self.overlay_text = TextCache(pygame.font.Font(None, 20))
+    if frame_profiler.frames % OVERLAY_REFRESH == 0 or not self.overlay_lines:
+      self.overlay_lines = [("phase", "avg ms", "p99 ms")]
+      for phase, average, p99 in frame_profiler.stats():
+        self.overlay_lines.append((phase, f"{average:.2f}", f"{p99:.2f}"))
+
+    x, y = self.field.get_width() - 210, 40
+    rect = pygame.draw.rect(self.field, "black", (x - 5, y - 5, 210, len(self.overlay_lines) * 16 + 10))
+    for phase, average, p99 in self.overlay_lines:
+      self.field.blit(self.overlay_text.render(phase, "white"), (x, y))
+      # Numbers are right aligned in their columns
+      for text, right in ((average, x + 150), (p99, x + 200)):
+        text_surface = self.overlay_text.render(text, "white")
+        self.field.blit(text_surface, (right - text_surface.get_width(), y))
+      y += 16
+    return rect
+
+  def draw_lives(self, player):
+    heart_icon = self.heart("red", 18)
+    lives_text = self.text.render(f" {player.lives}", "black")
+    rect = self.field.blit(heart_icon, (10, 12))
+    return rect.union(self.field.blit(lives_text, (30, 10)))
+
+  #---------------------------------------------------------------
+  # Menu screens never change, so each one is built on its own surface the first time
+  # it is shown and then blitted in one go
+
+  def draw_screen(self, name, build):
+    self.full_redraw = True
+    if name not in self.screens:
+      screen = pygame.Surface(RESOLUTION)
+      self.screens[name] = (screen, build(screen))
+    screen, button_rect = self.screens[name]
+    self.field.blit(screen, (0, 0))
+    self.present()
+    return button_rect
+
+  def draw_start_screen(self):
+    return self.draw_screen("start", self.build_start_screen)
+
+  def draw_end_screen(self):
+    return self.draw_screen("end", self.build_end_screen)
+
+  def draw_win_screen(self):
+    return self.draw_screen("win", self.build_win_screen)
+
+  def draw_pause_screen(self):
+    return self.draw_screen("pause", self.build_pause_screen)
+
+  def build_start_screen(self, surface):
+    font = self.font
+    surface.fill("white")
+    title = font.render("Qix Game", True, "black")
+    surface.blit(title, (surface.get_width() // 2 - title.get_width() // 2, 100))
+    instructions = [
+        font.render("Use Arrow Keys to move", True, "black"),
+        font.render("Press Spacebar to start incursion", True, "black"),
+        font.render("Press Escape to pause the game", True, "black"),
+        font.render("Claim 50% of the field to win", True, "black")
+    ]
+    for i, line in enumerate(instructions):
+        surface.blit(line, (surface.get_width() // 2 - line.get_width() // 2, 200 + i * 40))
+
+    button_rect = pygame.Rect(surface.get_width() // 2 - 50, 400, 100, 50)
+    pygame.draw.rect(surface, "forestgreen", button_rect)
+    button_text = font.render("Start", True, "white")
+    text_rect = button_text.get_rect(center=button_rect.center)
+    surface.blit(button_text, text_rect)
+
+    return button_rect
+
+  def build_end_screen(self, surface):
+    font = self.font
+    surface.fill("white")
+    title = font.render("Game Over", True, "black")
+    surface.blit(title, (surface.get_width() // 2 - title.get_width() // 2, 100))
+
+    button_text = font.render("Play Again", True, "white")
+    button_rect = pygame.Rect(surface.get_width() // 2 - 50, 400, button_text.get_width() + 30, 50)
+    pygame.draw.rect(surface, "forestgreen", button_rect)
+    text_rect = button_text.get_rect(center=button_rect.center)
+    surface.blit(button_text, text_rect)
+
+    return button_rect
+
+  def build_win_screen(self, surface):
+    font = self.font
+    surface.fill("white")
+    title = font.render("Congratulations, You Won!", True, "black")
+    surface.blit(title, (surface.get_width() // 2 - title.get_width() // 2, 100))
+
+    button_rect = pygame.Rect(surface.get_width() // 2 - 50, 400, 100, 50)
+    pygame.draw.rect(surface, "forestgreen", button_rect)
+    button_text = font.render("Exit", True, "white")
+    text_rect = button_text.get_rect(center=button_rect.center)
+    surface.blit(button_text, text_rect)
+
+    return button_rect
+
+  def build_pause_screen(self, surface):
+    font = self.font
+    surface.fill("white")
+    title = font.render("Game Paused", True, "black")
+    surface.blit(title, (surface.get_width() // 2 - title.get_width() // 2, 100))
+
+    button_rect = pygame.Rect(surface.get_width() // 2 - 50, 400, 100, 50)
+    pygame.draw.rect(surface, "forestgreen", button_rect)
+    button_text = font.render("Resume", True, "white")
+    text_rect = button_text.get_rect(center=button_rect.center)
+    surface.blit(button_text, text_rect)
+
+    return button_rect
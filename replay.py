@@ -0,0 +1,155 @@
+"""
+Recording and headless playback of games.
+
+A recording is the seed of the game plus its input log (see GameSim.log), stored in a compact binary file:
+  header: magic, format version, enemy backend, seed, number of frames, number of log entries
+  log: one (frame, inputs) entry per frame that had inputs or a level reset, 5 bytes each
+  footer: fingerprint of the final state (level, state, area remaining, lives, player position, enemy positions)
+
+Playing a recording back runs the simulation as fast as the CPU allows and checks that it ends in the
+same state and that no Qix was ever left on captured territory, so bug reports and slowdowns can be turned
+into regression cases:
+  python replay.py check recordings/*.qxr --min-fps 5000
+"""
+import argparse
+import struct
+import sys
+import time
+import zlib
+
+from sim import GameSim, LOG_RESET
+
+MAGIC = b"QXRP"
+VERSION = 2
+# Version 1 stored the seed as an unsigned 32-bit int, version 2 as a signed 64-bit one like GameSim seeds
+HEADERS = {1: struct.Struct("<4sBBIII"), 2: struct.Struct("<4sBBqII")}
+HEADER = HEADERS[VERSION]
+ENTRY = struct.Struct("<IB")
+FOOTER = struct.Struct("<BBIiddI")
+STATES = ("playing", "over", "win")
+BACKENDS = ("auto", "objects", "pool")
+
+
+class Recording:
+  """
+  seed: seed the game was played with
+  enemy_backend: enemy backend of the recorded GameSim, the pool and the objects do not use the same random streams
+  frames: number of frames simulated
+  log: input log of the game, list of (frame, inputs)
+  fingerprint: fingerprint() of the final state
+  """
+  def __init__(self, seed, enemy_backend, frames, log, fingerprint):
+    self.seed = seed
+    self.enemy_backend = enemy_backend
+    self.frames = frames
+    self.log = log
+    self.fingerprint = fingerprint
+
+  @classmethod
+  def from_sim(cls, sim: GameSim):
+    return cls(sim.seed, sim.enemy_backend, sim.frame, list(sim.log), fingerprint(sim))
+
+  def save(self, path):
+    with open(path, "wb") as file:
+      file.write(HEADER.pack(MAGIC, VERSION, BACKENDS.index(self.enemy_backend), self.seed, self.frames, len(self.log)))
+      for frame, inputs in self.log:
+        file.write(ENTRY.pack(frame, inputs))
+      file.write(FOOTER.pack(*self.fingerprint))
+
+  @classmethod
+  def load(cls, path):
+    with open(path, "rb") as file:
+      data = file.read()
+    magic, version = struct.unpack_from("<4sB", data, 0)
+    if magic != MAGIC or version not in HEADERS:
+      raise ValueError(f"{path} is not a version {VERSION} recording")
+    header = HEADERS[version]
+    _, _, backend, seed, frames, count = header.unpack_from(data, 0)
+    log = [ENTRY.unpack_from(data, header.size + i * ENTRY.size) for i in range(count)]
+    fingerprint = FOOTER.unpack_from(data, header.size + count * ENTRY.size)
+    return cls(seed, BACKENDS[backend], frames, log, fingerprint)
+
+
+def fingerprint(sim: GameSim):
+  """
+  Small summary of the state of sim, equal for two sims only if they are in the same state
+  """
+  positions = sim.enemies.positions().tolist()
+  enemy_crc = zlib.crc32(repr([(x, y) for x, y in positions]).encode())
+  return (sim.level, STATES.index(sim.state), sim.map.area_remaining, sim.player.lives,
+          float(sim.player.x), float(sim.player.y), enemy_crc)
+
+
+def play(recording: Recording, levels=None):
+  """
+  Replay recording headlessly as fast as possible and return the resulting GameSim
+  """
+  for sim in steps(recording, levels):
+    pass
+  return sim
+
+
+def steps(recording: Recording, levels=None):
+  """
+  Replay recording one step at a time, yields the GameSim before the first step and after every step
+  """
+  log = recording.log
+  sim = GameSim(levels, log[0][1] & ~LOG_RESET, recording.enemy_backend, recording.seed)
+  yield sim
+  for frame, inputs in log[1:]:
+    while sim.frame < frame and sim.state == "playing":
+      sim.step(0)
+      yield sim
+    if inputs & LOG_RESET:
+      sim.reset_level(inputs & ~LOG_RESET)
+    else:
+      sim.step(inputs)
+      yield sim
+  while sim.frame < recording.frames and sim.state == "playing":
+    sim.step(0)
+    yield sim
+
+
+def trapped_qix(sim: GameSim):
+  """
+  Positions of the Qix of sim that are on captured cells, which a capture never leaves a Qix on
+  """
+  return [point for point in sim.enemies.qix_positions() if sim.map.is_captured(*point)]
+
+
+def check(path, min_fps=0):
+  """
+  Play the recording at path back and check it ends in the recorded state, without a Qix ever trapped
+  in captured territory. The Qix are checked whenever the map changes
+  """
+  recording = Recording.load(path)
+  trapped, checked = None, None
+  start = time.perf_counter()
+  for sim in steps(recording):
+    if checked != (id(sim.map), sim.map.version):
+      checked = (id(sim.map), sim.map.version)
+      if trapped is None and trapped_qix(sim):
+        trapped = (sim.frame, trapped_qix(sim))
+  elapsed = time.perf_counter() - start
+  fps = sim.frame / elapsed if elapsed > 0 else float("inf")
+  ok = fingerprint(sim) == recording.fingerprint and fps >= min_fps and trapped is None
+  print(f"{'ok  ' if ok else 'FAIL'} {path}: {sim.frame} frames in {elapsed:.3f}s ({fps:.0f} frames/s)")
+  if fingerprint(sim) != recording.fingerprint:
+    print(f"     expected {recording.fingerprint}\n     got      {fingerprint(sim)}")
+  if trapped is not None:
+    print(f"     Qix on captured cells after frame {trapped[0]}: {trapped[1]}")
+  return ok
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Play back recorded games headlessly and check they end the same way")
+  parser.add_argument("command", choices=["check"])
+  parser.add_argument("recordings", nargs="+")
+  parser.add_argument("--min-fps", type=float, default=0, help="also fail if playback is slower than this many frames per second")
+  args = parser.parse_args(argv)
+  results = [check(path, args.min_fps) for path in args.recordings]
+  return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+  sys.exit(main())
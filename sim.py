@@ -0,0 +1,177 @@
+import random
+
+from levels import LevelPreloader, build_map, level_specs
+from pool import EnemyList, EnemyPool
+from profiler import frame_profiler
+from snapshot import take_snapshot, restore_snapshot
+
+# INPUT FLAGS
+# step() takes a bitmask of the key events that happened during the frame
+
+KEY_LEFT = 1
+KEY_RIGHT = 2
+KEY_UP = 4
+KEY_DOWN = 8
+KEY_SPACE = 16
+KEY_RELEASE = 32
+
+# Marks a level reset in an input log, the level number is in the low bits
+LOG_RESET = 128
+
+# Levels with more enemies than this use the batched EnemyPool backend when enemy_backend is "auto"
+POOL_THRESHOLD = 16
+
+# Simulation steps per second, every speed in the game is in pixels per step
+TICK_RATE = 60
+
+# Anything that moved further than this in one step (a respawn) is drawn where it is instead of interpolated
+MAX_LERP = 20
+
+# Seeds are stored in recordings and snapshots as signed 64-bit ints
+SEED_MIN, SEED_MAX = -2**63, 2**63 - 1
+
+
+class GameSim:
+  """
+  Headless simulation of the game. Nothing in here creates a display or draws anything,
+  so it can be stepped as fast as the CPU allows (bots, balance checks) or once per frame by main.py
+  levels: list of LevelSpec to play through, a fresh map is built from the spec on every reset
+  level: index of the level currently being played
+  state: "playing", "over" (no lives left) or "win" (last level completed)
+  frame: number of frames simulated since the sim was created
+  enemy_backend: "objects" to move every Qix and Sparc object on its own, "pool" to move them all in one
+  batched EnemyPool step, or "auto" to use the pool only for levels with many enemies
+  enemies: EnemyList of the enemy objects, or an EnemyPool when the pool backend is in use
+  seed: seed every random stream of the game is derived from, the same seed and inputs give the same game
+  log: list of (frame, inputs) for every frame with inputs, and (frame, LOG_RESET | level) for every level reset,
+  or None when the sim is not recording
+  preloader: LevelPreloader building the maps for a reset of the current level and for the next level
+  in the background while the current one is played, or None to build maps only when needed
+  interpolate: True to keep the positions from before the last step (previous_player, previous_enemies),
+  so positions() can place things between two steps when rendering faster than the simulation
+  """
+  def __init__(self, levels=None, level=0, enemy_backend="auto", seed=None, record=False, preload=False,
+               interpolate=False):
+    self.levels = level_specs if levels is None else levels
+    self.preloader = LevelPreloader(self.levels) if preload else None
+    self.enemy_backend = enemy_backend
+    self.seed = random.randrange(2**32) if seed is None else seed
+    if not SEED_MIN <= self.seed <= SEED_MAX:
+      raise ValueError(f"seed must be between {SEED_MIN} and {SEED_MAX}")
+    self.log = [] if record else None
+    self.interpolate = interpolate
+    self.frame = 0
+    self.reset_level(level)
+
+  def reset_level(self, level):
+    if self.log is not None:
+      self.log.append((self.frame, LOG_RESET | level))
+    self.load_level(level)
+
+  def load_level(self, level):
+    self.level = level
+    if self.preloader is None:
+      self.map = build_map(self.levels[level])
+    else:
+      self.map = self.preloader.get(level)
+      self.preloader.prepare(level)
+      self.preloader.prepare(level + 1)
+    self.player = self.map.init_player
+    self.enemies = self.map.enemies
+    # Every enemy gets its own random stream, derived from the seed, level and its index
+    for i, enemy in enumerate(self.enemies):
+      if hasattr(enemy, "rng"):
+        enemy.rng.seed(f"{self.seed}:{level}:{i}")
+    if self.enemy_backend == "pool" or (self.enemy_backend == "auto" and len(self.enemies) > POOL_THRESHOLD):
+      self.enemies = EnemyPool(self.enemies, random.Random(f"{self.seed}:{level}:pool").getrandbits(64))
+    else:
+      self.enemies = EnemyList(self.enemies)
+    if self.interpolate:
+      self.save_previous()
+    self.state = "playing"
+
+  def apply_inputs(self, inputs):
+    player = self.player
+    if inputs & KEY_RELEASE:
+      player.vel_x = 0
+      player.vel_y = 0
+    # The player moves along one axis at a time, the last direction pressed wins
+    if inputs & KEY_LEFT:
+      player.vel_x, player.vel_y = -1, 0
+    elif inputs & KEY_RIGHT:
+      player.vel_x, player.vel_y = 1, 0
+    if inputs & KEY_UP:
+      player.vel_x, player.vel_y = 0, -1
+    elif inputs & KEY_DOWN:
+      player.vel_x, player.vel_y = 0, 1
+    if inputs & KEY_SPACE and not player.incursion:
+      player.start_incursion()
+
+  def step(self, inputs=0):
+    """
+    Advance the simulation by one frame and return the resulting state
+    """
+    if self.state != "playing":
+      return self.state
+    if inputs and self.log is not None:
+      self.log.append((self.frame, inputs))
+    if self.interpolate:
+      self.save_previous()
+    self.apply_inputs(inputs)
+    self.player.update(self.map, self.enemies)
+    frame_profiler.lap("player.update")
+    self.enemies.update(self.map, self.player)
+    frame_profiler.lap("enemies.move")
+    self.frame += 1
+
+    if self.player.lives <= 0:
+      self.state = "over"
+    elif self.map.complete:
+      if self.level == len(self.levels) - 1:
+        self.state = "win"
+      else:
+        self.load_level(self.level + 1)
+    return self.state
+
+  def save_previous(self):
+    player = self.player
+    self.previous_player = (player.x, player.y)
+    self.previous_enemies = self.enemies.positions()
+
+  def positions(self, alpha):
+    """
+    Player position and enemy positions (an (n, 2) array) alpha of the way (0 to 1)
+    from where they were before the last step to where they are now
+    """
+    player = self.player
+    player_position = _lerp(self.previous_player, (player.x, player.y), alpha)
+    previous, current = self.previous_enemies, self.enemies.positions()
+    jumped = (abs(current - previous) > MAX_LERP).any(axis=1)
+    positions = previous + (current - previous) * alpha
+    positions[jumped] = current[jumped]
+    return player_position, positions
+
+  def snapshot(self):
+    """
+    The whole state of the game as bytes, which restore() can go back to (see snapshot.py)
+    """
+    return take_snapshot(self)
+
+  def restore(self, data):
+    restore_snapshot(self, data)
+
+  def run(self, frames, inputs=0):
+    """
+    Step the simulation frames times (or until the game ends), applying inputs on the first frame
+    """
+    for _ in range(frames):
+      if self.step(inputs) != "playing":
+        break
+      inputs = 0
+    return self.state
+
+
+def _lerp(previous, current, alpha):
+  if abs(current[0] - previous[0]) > MAX_LERP or abs(current[1] - previous[1]) > MAX_LERP:
+    return current
+  return (previous[0] + (current[0] - previous[0]) * alpha, previous[1] + (current[1] - previous[1]) * alpha)
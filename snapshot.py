@@ -0,0 +1,228 @@
+"""
+Snapshots of the whole state of a GameSim (map, territory, player, trail, enemies and every random stream)
+as compact bytes, cheap enough to take every frame:
+  data = sim.snapshot()
+  sim.restore(data)  # The game goes on exactly as it would have from the moment of the snapshot
+A snapshot can be restored into any GameSim playing the same levels, so bots can branch a game into many.
+
+Layout, all little-endian:
+  header: magic, format version, level, state, enemy backend, seed, frame, length of the input log
+  map: size, target, version, areas, complete, origin, the boundary as float64 points,
+  and the occupancy packed 8 cells to a byte. The distance field is not stored, it follows from the occupancy.
+  The last few fields are kept by packed occupancy, so restoring a snapshot of a territory that was saved or restored
+  lately (rewinding within a level) copies the field instead of rebuilding it
+  player: lives, position, velocity, incursion, arc (NaN for None), invincibility frames and the trail points
+  enemies: every Qix (with its Mersenne Twister state) and Sparc, or the EnemyPool arrays and PCG64 state
+"""
+import math
+import struct
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+from boundary import Boundary
+from game import Map, Player, Qix, Sparc
+from pool import EnemyList, EnemyPool
+
+MAGIC = b"QXSS"
+VERSION = 3
+HEADER = struct.Struct("<4sBBBBqII")
+MAP = struct.Struct("<IdIIIBddI")
+PLAYER = struct.Struct("<iddddBdII")
+ENEMIES = struct.Struct("<BI")
+QIX_STATE = struct.Struct("<ddddiBd")
+SPARC_STATE = struct.Struct("<dddd?idbB")
+POOL_STATE = struct.Struct("<B16s16sBI")
+STATES = ("playing", "over", "win")
+BACKENDS = ("auto", "objects", "pool")
+# Enemy backend classes, by the byte that tells them apart in the enemies part
+ENEMY_BACKENDS = (EnemyList, EnemyPool)
+QIX, SPARC = 0, 1
+# Length of the state of a random.Random, 624 words and the index into them
+TWISTER_WORDS = 625
+# How many distance fields are kept, a byte per cell each
+DISTANCE_CACHE_SIZE = 4
+
+# (size, packed occupancy) -> distance field bytes, least recently used first
+_distances = OrderedDict()
+
+
+def take_snapshot(sim):
+  map, player, enemies = sim.map, sim.player, sim.enemies
+  log_length = 0 if sim.log is None else len(sim.log)
+  parts = [HEADER.pack(MAGIC, VERSION, sim.level, STATES.index(sim.state), BACKENDS.index(sim.enemy_backend),
+                       sim.seed, sim.frame, log_length)]
+
+  boundary_points = map.boundary.points
+  parts.append(MAP.pack(map.size, map.target, map.version, map.area_remaining, map.captured_area, map.complete,
+                        *map.origin, len(boundary_points)))
+  parts.append(_points(boundary_points))
+  occupancy = np.packbits(map.grid).tobytes()
+  parts.append(occupancy)
+  _cache_distance((map.size, occupancy), map)
+
+  arc = math.nan if player.arc is None else player.arc
+  parts.append(PLAYER.pack(player.lives, player.x, player.y, player.vel_x, player.vel_y, player.incursion, arc,
+                           player.invincible, len(player.path)))
+  parts.append(_points(player.path))
+
+  enemy_backend = ENEMY_BACKENDS.index(type(enemies))
+  parts.append(ENEMIES.pack(enemy_backend, len(enemies)))
+  (_save_objects, _save_pool)[enemy_backend](enemies, parts)
+  return b"".join(parts)
+
+
+def restore_snapshot(sim, data):
+  reader = _Reader(data)
+  magic, version, level, state, backend, seed, frame, log_length = reader.unpack(HEADER)
+  if magic != MAGIC or version != VERSION:
+    raise ValueError(f"not a version {VERSION} snapshot")
+
+  size, target, map_version, area_remaining, captured_area, complete, x, y, boundary_count = reader.unpack(MAP)
+  boundary_points = _pairs(reader.array("d", 2 * boundary_count))
+
+  map = Map(size, ((x, y), (x + size, y), (x + size, y + size), (x, y + size)), None, [], target)
+  occupancy = bytes(reader.read((size * size + 7) // 8))
+  map.grid[:] = np.unpackbits(np.frombuffer(occupancy, dtype=np.uint8), count=size * size).reshape(size, size)
+  distance = _distances.get((size, occupancy))
+  if distance is None:
+    map.update_distance(0, 0, size, size)
+    _cache_distance((size, occupancy), map)
+  else:
+    map.distance[:] = distance
+    _distances.move_to_end((size, occupancy))
+  map.version = map_version
+  map.area_remaining = area_remaining
+  map.captured_area = captured_area
+  map.complete = bool(complete)
+  map.boundary = Boundary(boundary_points)
+
+  lives, x, y, vel_x, vel_y, incursion, arc, invincible, path_length = reader.unpack(PLAYER)
+  player = Player(lives, x, y, vel_x, vel_y)
+  player.incursion = bool(incursion)
+  player.arc = None if math.isnan(arc) else arc
+  player.invincible = invincible
+  path = _pairs(reader.array("d", 2 * path_length))
+  if path:
+    player.path = [path[0]]
+    for point in path[1:]:
+      player.extend_path(point)
+  map.init_player = player
+
+  enemy_backend, count = reader.unpack(ENEMIES)
+  enemies = (_restore_objects, _restore_pool)[enemy_backend](reader, count, map)
+
+  sim.level, sim.state, sim.enemy_backend, sim.seed, sim.frame = level, STATES[state], BACKENDS[backend], seed, frame
+  sim.map, sim.player, sim.enemies = map, player, enemies
+  if sim.log is not None:
+    del sim.log[log_length:]  # Inputs after the snapshot never happened
+  if sim.preloader is not None:
+    sim.preloader.prepare(level)
+    sim.preloader.prepare(level + 1)
+  if sim.interpolate:
+    sim.save_previous()
+
+
+def _save_objects(enemies, parts):
+  for enemy in enemies:
+    if type(enemy) == Qix:
+      _, words, gauss = enemy.rng.getstate()
+      parts.append(bytes((QIX,)))
+      parts.append(QIX_STATE.pack(enemy.x, enemy.y, enemy.vel_x, enemy.vel_y, enemy._moving, gauss is not None,
+                                  0.0 if gauss is None else gauss))
+      parts.append(array("I", words).tobytes())
+    else:
+      parts.append(bytes((SPARC,)))
+      parts.append(SPARC_STATE.pack(enemy.x, enemy.y, enemy.vel_x, enemy.vel_y, enemy.horizontal, enemy._speed,
+                                    enemy.arc, enemy.direction, enemy.boundary is not None))
+
+
+def _save_pool(enemies, parts):
+  state = enemies.rng.bit_generator.state
+  parts.append(POOL_STATE.pack(enemies.boundary is not None, state["state"]["state"].to_bytes(16, "little"),
+                               state["state"]["inc"].to_bytes(16, "little"), state["has_uint32"], state["uinteger"]))
+  for values, dtype in _pool_arrays(enemies):
+    parts.append(values.astype(dtype, copy=False).tobytes())
+
+
+def _restore_objects(reader, count, map):
+  objects = []
+  for _ in range(count):
+    if reader.read(1)[0] == QIX:
+      x, y, vel_x, vel_y, moving, has_gauss, gauss = reader.unpack(QIX_STATE)
+      enemy = Qix(x, y)
+      enemy.vel_x, enemy.vel_y, enemy._moving = vel_x, vel_y, moving
+      enemy.rng.setstate((3, tuple(reader.array("I", TWISTER_WORDS)), gauss if has_gauss else None))
+    else:
+      x, y, vel_x, vel_y, horizontal, speed, arc, direction, placed = reader.unpack(SPARC_STATE)
+      enemy = Sparc(x, y, 0, 1)
+      enemy.vel_x, enemy.vel_y, enemy.horizontal, enemy._speed = vel_x, vel_y, horizontal, speed
+      enemy.arc, enemy.direction = arc, direction
+      enemy.boundary = map.boundary if placed else None
+    enemy.hitbox.update(enemy.x - enemy.radius, enemy.y - enemy.radius, 2 * enemy.radius, 2 * enemy.radius)
+    objects.append(enemy)
+  map.enemies = objects
+  return EnemyList(objects)
+
+
+def _restore_pool(reader, count, map):
+  enemies = EnemyPool([])
+  placed, rng_state, inc, has_uint32, uinteger = reader.unpack(POOL_STATE)
+  enemies.rng.bit_generator.state = {"bit_generator": "PCG64",
+                                     "state": {"state": int.from_bytes(rng_state, "little"),
+                                               "inc": int.from_bytes(inc, "little")},
+                                     "has_uint32": has_uint32, "uinteger": uinteger}
+  for name, (values, dtype) in zip(("kind", "pos", "vel", "radius", "timer", "horizontal", "arc", "direction",
+                                    "speed"), _pool_arrays(enemies)):
+    shape = (count, 2) if values.ndim == 2 else (count,)
+    setattr(enemies, name, np.frombuffer(reader.read(math.prod(shape) * np.dtype(dtype).itemsize),
+                                         dtype=dtype).reshape(shape).copy())
+  enemies.build_buffers()
+  if placed:
+    enemies.use_boundary(map.boundary)
+  return enemies
+
+
+def _pool_arrays(pool):
+  return ((pool.kind, np.int8), (pool.pos, np.float64), (pool.vel, np.float64), (pool.radius, np.float64),
+          (pool.timer, np.int32), (pool.horizontal, bool), (pool.arc, np.float64), (pool.direction, np.float64),
+          (pool.speed, np.float64))
+
+
+def _cache_distance(key, map):
+  if key in _distances:
+    _distances.move_to_end(key)
+    return
+  _distances[key] = bytes(map.distance)
+  if len(_distances) > DISTANCE_CACHE_SIZE:
+    _distances.popitem(last=False)
+
+
+def _points(points):
+  return array("d", [value for point in points for value in point]).tobytes()
+
+
+def _pairs(values):
+  return list(zip(values[::2], values[1::2]))
+
+
+class _Reader:
+  def __init__(self, data):
+    self.data = memoryview(data)
+    self.offset = 0
+
+  def read(self, size):
+    chunk = self.data[self.offset:self.offset + size]
+    if len(chunk) != size:
+      raise ValueError("snapshot is truncated")
+    self.offset += size
+    return chunk
+
+  def unpack(self, layout):
+    return layout.unpack(self.read(layout.size))
+
+  def array(self, typecode, count):
+    values = array(typecode)
+    values.frombytes(self.read(count * values.itemsize))
+    return values